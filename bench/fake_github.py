@@ -0,0 +1,108 @@
+"""Локальная замена GitHub API для бенчмарков: repo, traffic и GraphQL с настраиваемыми задержкой,
+лимитами, 304 и ошибками.
+
+    python bench/fake_github.py --port 9000 --latency 0.02 --error-rate 0.01 --not-modified-rate 0.5
+"""
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+config = argparse.Namespace(latency=0.02, error_rate=0.0, not_modified_rate=0.5, rate_limit=5000, rate_window=60.0)
+app = FastAPI(title="Fake GitHub API")
+
+# (токен, ресурс) -> [остаток, время сброса]
+_budgets = {}
+
+def number(*parts, limit=1000):
+    """Стабильное псевдослучайное число для репозитория — одинаковые ответы между прогонами"""
+    return int(hashlib.md5('/'.join(parts).encode()).hexdigest()[:8], 16) % limit
+
+def spend(request, resource, cost=1):
+    """Списывает запрос с бюджета токена, возвращает заголовки X-RateLimit-* и признак исчерпания"""
+    token = request.headers.get('authorization', '')
+    now = time.time()
+    budget = _budgets.get((token, resource))
+    if budget is None or now >= budget[1]:
+        budget = _budgets[(token, resource)] = [config.rate_limit, now + config.rate_window]
+    exhausted = budget[0] <= 0
+    if not exhausted:
+        budget[0] -= cost
+    headers = {
+        'X-RateLimit-Limit': str(config.rate_limit),
+        'X-RateLimit-Remaining': str(budget[0]),
+        'X-RateLimit-Reset': str(int(budget[1])),
+        'X-RateLimit-Resource': resource,
+    }
+    return headers, exhausted
+
+async def respond(request, resource, body):
+    await asyncio.sleep(config.latency * random.uniform(0.5, 1.5))
+    # Как и у GitHub, 304 на условный запрос не расходует лимит
+    not_modified = request.headers.get('if-none-match') and random.random() < config.not_modified_rate
+    headers, exhausted = spend(request, resource, cost=0 if not_modified else 1)
+    if exhausted:
+        return JSONResponse({"message": "API rate limit exceeded"}, status_code=403, headers=headers)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    if random.random() < config.error_rate:
+        return JSONResponse({"message": "Server Error"}, status_code=502, headers=headers)
+    headers['ETag'] = f'"{random.getrandbits(64):016x}"'
+    return JSONResponse(body, headers=headers)
+
+def traffic(owner, repo, kind):
+    today = datetime.now(timezone.utc).date()
+    items = [
+        {"timestamp": f"{today - timedelta(days=i)}T00:00:00Z", "count": number(owner, repo, kind, str(i), limit=200),
+         "uniques": number(owner, repo, kind, 'u', str(i), limit=50)}
+        for i in range(14)
+    ]
+    return {"count": sum(i["count"] for i in items), "uniques": sum(i["uniques"] for i in items), kind: items}
+
+@app.get("/repos/{owner}/{repo}")
+async def repository(owner: str, repo: str, request: Request):
+    return await respond(request, "core", {
+        "full_name": f"{owner}/{repo}",
+        "stargazers_count": number(owner, repo, 'stars'),
+        "forks_count": number(owner, repo, 'forks', limit=100),
+        "permissions": {"admin": True, "push": True, "pull": True},
+    })
+
+@app.get("/repos/{owner}/{repo}/traffic/{kind}")
+async def repository_traffic(owner: str, repo: str, kind: str, request: Request):
+    if kind not in ("views", "clones"):
+        return JSONResponse({"message": "Not Found"}, status_code=404)
+    return await respond(request, "core", traffic(owner, repo, kind))
+
+@app.post("/graphql")
+async def graphql(request: Request):
+    payload = await request.json()
+    query, variables = payload["query"], payload.get("variables") or {}
+    if 'stargazers' in query:
+        edges = [{"starredAt": f"{datetime.now(timezone.utc).date() - timedelta(days=i)}T00:00:00Z"} for i in range(10)]
+        data = {"repository": {"stargazers": {"pageInfo": {"hasNextPage": False, "endCursor": None}, "edges": edges}}}
+    else:
+        data = {
+            alias: {"stargazerCount": number(variables[o], variables[n], 'stars'),
+                    "forkCount": number(variables[o], variables[n], 'forks', limit=100)}
+            for alias, o, n in re.findall(r'(r\d+): repository\(owner: \$(o\d+), name: \$(n\d+)\)', query)
+        }
+    return await respond(request, "graphql", {"data": data})
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=config.latency, help="средняя задержка ответа, с")
+    parser.add_argument("--error-rate", type=float, default=config.error_rate, help="доля ответов 502")
+    parser.add_argument("--not-modified-rate", type=float, default=config.not_modified_rate,
+                        help="доля 304 на условные запросы")
+    parser.add_argument("--rate-limit", type=int, default=config.rate_limit, help="запросов на токен за окно")
+    parser.add_argument("--rate-window", type=float, default=config.rate_window, help="окно лимита, с")
+    config = parser.parse_args()
+    uvicorn.run(app, host="127.0.0.1", port=config.port, log_level="warning")
@@ -0,0 +1,282 @@
+"""Сквозной бенчмарк: приложение против локального fake GitHub на 10/1k/10k репозиториев.
+
+Для каждого размера поднимает чистую базу и сервер, меряет /track, прогон авто-сбора,
+/stats из кеша и параллельную нагрузку на /dashboard, пиковый RSS процесса и сравнивает
+результат с bench/baseline.json. Цифры зависят от машины: базовую линию стоит записывать
+на той же машине, где запускается проверка перед деплоем.
+
+    python bench/run.py                              # все размеры, сравнение с базовой линией
+    python bench/run.py --sizes 10,1000 --latency 0.05
+    python bench/run.py --repeat 3                   # медиана трех прогонов на размер
+    python bench/run.py --update-baseline            # записать текущие цифры как базовую линию
+    python bench/run.py > bench_output.txt           # код выхода 1 при регрессии
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "bench", "baseline.json")
+
+# Метрика -> лучше больше ("higher") или меньше ("lower")
+METRICS = {
+    "track_p50_ms": "lower",
+    "track_p99_ms": "lower",
+    "collect_repos_per_sec": "higher",
+    "stats_p50_ms": "lower",
+    "stats_p99_ms": "lower",
+    "dashboard_rps": "higher",
+    "dashboard_p50_ms": "lower",
+    "dashboard_p99_ms": "lower",
+    "peak_rss_mb": "lower",
+}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+def latency_stats(prefix, samples):
+    return {
+        f"{prefix}_p50_ms": round(percentile(samples, 50) * 1000, 2),
+        f"{prefix}_p99_ms": round(percentile(samples, 99) * 1000, 2),
+    }
+
+def peak_rss_mb(pid):
+    """Пиковый RSS процесса (VmHWM) по /proc — только Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def parse_metrics(text):
+    """Значения /metrics: по каждой серии с метками и суммой по имени метрики"""
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            name = series.split("{", 1)[0]
+            values[series] = float(value)
+            if name != series:
+                values[name] = values.get(name, 0) + float(value)
+    return values
+
+def start_process(args, cwd, env=None):
+    return subprocess.Popen(args, cwd=cwd, env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} не поднялся за {timeout} с")
+
+async def timed(samples, call):
+    started = time.perf_counter()
+    response = await call
+    samples.append(time.perf_counter() - started)
+    return response
+
+async def run_size(size, options, fake_url):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    app = start_process(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        env={"PYTHONPATH": ROOT, "GITHUB_API_URL": fake_url,
+             "DATABASE_PATH": os.path.join(workdir, "github_analytics.db")},
+    )
+    try:
+        await wait_ready(f"{base}/metrics")
+        result = {"repos": size}
+        limits = httpx.Limits(max_connections=options.clients * 2)
+        async with httpx.AsyncClient(base_url=base, timeout=120, limits=limits) as client:
+            # Сессии по токену на каждые repos_per_token репозиториев
+            sessions = []
+            for i in range(max(1, math.ceil(size / options.repos_per_token))):
+                # Без сброса cookie сервер сохранил бы каждый токен в одну и ту же сессию
+                client.cookies.clear()
+                response = await client.post("/token", data={"token": f"bench-token-{i}"})
+                sessions.append(response.cookies["session_id"])
+            client.cookies.clear()
+            repos = [(sessions[i % len(sessions)], f"owner{i % 97}", f"repo{i}") for i in range(size)]
+
+            # /track с живым запросом к GitHub — на небольшой выборке, остальное пишется в базу напрямую
+            track_samples = []
+            sample = repos[:min(size, options.track_sample)]
+            for session_id, owner, repo in sample:
+                await timed(track_samples, client.post("/track", data={"owner": owner, "repo": repo},
+                                                       cookies={"session_id": session_id}))
+            result.update(latency_stats("track", track_samples))
+            conn = sqlite3.connect(os.path.join(workdir, "github_analytics.db"), timeout=30)
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO tracked_repos (session_id, owner, repo_name, next_due_at) "
+                    "VALUES (?, ?, ?, '9999-12-31')",
+                    repos[len(sample):],
+                )
+            conn.close()
+
+            # Прогон авто-сбора: до тех пор, пока все репозитории не получат результат
+            before = parse_metrics((await client.get("/metrics")).text).get("collect_repos_total", 0)
+            started = time.perf_counter()
+            await client.post("/auto-collect")
+            while True:
+                metrics = parse_metrics((await client.get("/metrics")).text)
+                done = metrics.get("collect_repos_total", 0) - before
+                if done >= size and not metrics.get("collect_in_progress"):
+                    break
+                if time.perf_counter() - started > options.collect_timeout:
+                    raise RuntimeError(f"сбор {size} репозиториев не уложился в {options.collect_timeout} с")
+                await asyncio.sleep(0.2)
+            elapsed = time.perf_counter() - started
+            result["collect_seconds"] = round(elapsed, 2)
+            result["collect_repos_per_sec"] = round(size / elapsed, 1)
+            result["collect_failed"] = int(metrics.get('collect_repos_total{result="failure"}', 0))
+
+            # /stats по свежему снимку — путь через кеш в БД
+            stats_samples = []
+            # Выборка с повторами: на малых размерах иначе перцентили считались бы по нескольким запросам
+            for session_id, owner, repo in random.choices(repos, k=options.stats_sample):
+                await timed(stats_samples, client.post(f"/stats/{owner}/{repo}",
+                                                       cookies={"session_id": session_id}))
+            result.update(latency_stats("stats", stats_samples))
+
+            # Параллельная нагрузка на /dashboard
+            dashboard_samples = []
+            deadline = time.perf_counter() + options.dashboard_seconds
+
+            async def dashboard_client():
+                while time.perf_counter() < deadline:
+                    await timed(dashboard_samples, client.get("/dashboard", params={"limit": 100},
+                                                              cookies={"session_id": random.choice(sessions)}))
+
+            await asyncio.gather(*(dashboard_client() for _ in range(options.clients)))
+            result["dashboard_rps"] = round(len(dashboard_samples) / options.dashboard_seconds, 1)
+            result.update(latency_stats("dashboard", dashboard_samples))
+
+        result["peak_rss_mb"] = peak_rss_mb(app.pid)
+        return result
+    finally:
+        app.terminate()
+        app.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def median_result(runs):
+    """Медиана каждой метрики по прогонам — один прогон на общей машине слишком шумный"""
+    result = {}
+    for key in runs[0]:
+        values = sorted(run[key] for run in runs if run.get(key) is not None)
+        result[key] = values[(len(values) - 1) // 2] if values else None
+    return result
+
+def compare(results, baseline, tolerance):
+    """Печатает сравнение с базовой линией, возвращает список регрессий"""
+    regressions = []
+    for size, current in results.items():
+        reference = baseline.get(size, {})
+        print(f"\n=== {size} репозиториев ===")
+        for metric, direction in METRICS.items():
+            value, base = current.get(metric), reference.get(metric)
+            if value is None:
+                continue
+            if not base:
+                print(f"  {metric:24} {value:>10}")
+                continue
+            change = (value - base) / base
+            worse = change < -tolerance if direction == "higher" else change > tolerance
+            mark = "❌" if worse else "✅"
+            print(f"  {metric:24} {value:>10}  (база {base}, {change:+.0%}) {mark}")
+            if worse:
+                regressions.append(f"{size}: {metric} {value} против {base}")
+    return regressions
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,1000,10000", help="числа репозиториев через запятую")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка fake GitHub, с")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="доля ответов 502")
+    parser.add_argument("--not-modified-rate", type=float, default=0.5, help="доля 304 на условные запросы")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="лимит запросов на токен за окно")
+    parser.add_argument("--rate-window", type=float, default=60, help="окно лимита fake GitHub, с")
+    parser.add_argument("--repos-per-token", type=int, default=200)
+    parser.add_argument("--track-sample", type=int, default=20)
+    parser.add_argument("--stats-sample", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=20, help="параллельных клиентов /dashboard")
+    parser.add_argument("--dashboard-seconds", type=float, default=5)
+    parser.add_argument("--collect-timeout", type=float, default=600)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение, доля")
+    parser.add_argument("--repeat", type=int, default=1, help="прогонов на размер, сравнивается медиана")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    options = parser.parse_args()
+
+    fake_port = free_port()
+    fake = start_process([
+        sys.executable, os.path.join(ROOT, "bench", "fake_github.py"), "--port", str(fake_port),
+        "--latency", str(options.latency), "--error-rate", str(options.error_rate),
+        "--not-modified-rate", str(options.not_modified_rate),
+        "--rate-limit", str(options.rate_limit), "--rate-window", str(options.rate_window),
+    ], cwd=ROOT)
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    try:
+        await wait_ready(f"{fake_url}/docs")
+        results = {}
+        for size in (int(s) for s in options.sizes.split(",")):
+            runs = []
+            for attempt in range(options.repeat):
+                print(f"⏱️ {size} репозиториев ({attempt + 1}/{options.repeat})...", flush=True)
+                runs.append(await run_size(size, options, fake_url))
+            results[str(size)] = median_result(runs)
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline, options.tolerance)
+
+    if options.update_baseline:
+        with open(options.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n✅ Базовая линия обновлена: {options.baseline}")
+        return 0
+    if regressions:
+        print("\n❌ Регрессии:\n  " + "\n  ".join(regressions))
+        return 1
+    print("\n✅ Регрессий нет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,37 +1,433 @@
-from fastapi import FastAPI, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse
-import requests
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, Request, Form, Query, UploadFile, File
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+import httpx
+import asyncio
+import random
+from datetime import date, datetime, timedelta, timezone
 import sqlite3
+import csv
+import gzip
+import io
+import json
+import zlib
 import secrets
+import hashlib
+import functools
+import bisect
+import threading
+import time
+import contextvars
+import sys
 import os
 
-app = FastAPI(title="GitHub Analytics")
-DATABASE_PATH = "github_analytics.db"
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "github_analytics.db")
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
+GITHUB_TIMEOUT = float(os.environ.get("GITHUB_TIMEOUT", "20"))
+GITHUB_MAX_CONNECTIONS = int(os.environ.get("GITHUB_MAX_CONNECTIONS", "100"))
+COLLECT_CONCURRENCY = int(os.environ.get("COLLECT_CONCURRENCY", "20"))
+COLLECT_TOKEN_CONCURRENCY = int(os.environ.get("COLLECT_TOKEN_CONCURRENCY", "5"))
+COLLECT_REPO_TIMEOUT = float(os.environ.get("COLLECT_REPO_TIMEOUT", "60"))
+COLLECT_INTERVAL = float(os.environ.get("COLLECT_INTERVAL", str(6 * 3600)))
+COLLECT_JITTER = float(os.environ.get("COLLECT_JITTER", "0.1"))
+COLLECT_RETRY_DELAY = float(os.environ.get("COLLECT_RETRY_DELAY", "900"))
+SCHEDULER_TICK = float(os.environ.get("SCHEDULER_TICK", "30"))
+SCHEDULER_BATCH = int(os.environ.get("SCHEDULER_BATCH", "500"))
+STATS_TTL = float(os.environ.get("STATS_TTL", "300"))
+STATS_FLUSH_INTERVAL = float(os.environ.get("STATS_FLUSH_INTERVAL", "2"))
+STATS_FLUSH_BATCH = int(os.environ.get("STATS_FLUSH_BATCH", "200"))
+GRAPHQL_BATCH_SIZE = int(os.environ.get("GRAPHQL_BATCH_SIZE", "50"))
+TOKEN_ACCESS_TTL = float(os.environ.get("TOKEN_ACCESS_TTL", str(24 * 3600)))
+RATE_LIMIT_RESERVE = int(os.environ.get("RATE_LIMIT_RESERVE", "100"))
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "300"))
+RATE_LIMIT_MAX_WAIT = float(os.environ.get("RATE_LIMIT_MAX_WAIT", "30"))
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "2"))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+EXPORT_BATCH = int(os.environ.get("EXPORT_BATCH", "1000"))
+IMPORT_BATCH = int(os.environ.get("IMPORT_BATCH", "50000"))
+IMPORT_PACED_BATCH = int(os.environ.get("IMPORT_PACED_BATCH", "5000"))
+ROLLUP_REBUILD_BATCH = int(os.environ.get("ROLLUP_REBUILD_BATCH", "1000"))
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", "256"))
+EVENTS_PROGRESS_INTERVAL = float(os.environ.get("EVENTS_PROGRESS_INTERVAL", "1"))
+EVENTS_PING_INTERVAL = float(os.environ.get("EVENTS_PING_INTERVAL", "15"))
+LOOP_LAG_INTERVAL = float(os.environ.get("LOOP_LAG_INTERVAL", "0.5"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_COLLECT = os.environ.get("PROFILE_COLLECT", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))
+
+# ==================== МЕТРИКИ ====================
+# Метрики живут в памяти процесса и отдаются в текстовом формате Prometheus. Обновление — поиск
+# в словаре и сложение без блокировок: редкая гонка с потоками импорта стоит максимум одного отсчета.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+metrics_registry = []
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        metrics_registry.append(self)
+
+    def _labels(self, values, extra=()):
+        pairs = [*zip(self.labels, values), *extra]
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        yield from self.samples()
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f'{self.name}{self._labels(labels)} {value}'
+
+class Gauge(Metric):
+    """Значение выставляется явно или считается функцией collect в момент опроса"""
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def samples(self):
+        values = self.collect() if self.collect else self.values
+        for labels, value in values.items():
+            yield f'{self.name}{self._labels(labels)} {value}'
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, phase=None):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.phase = phase
+
+    def observe(self, value, *labels):
+        # Счетчики по корзинам не накопительные — суммы считаются только при опросе
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+        if self.phase is not None:
+            record_phase(self.phase, value)
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        for labels, data in self.values.items():
+            total = 0
+            for bound, count in zip((*self.buckets, '+Inf'), data):
+                total += count
+                yield f'{self.name}_bucket{self._labels(labels, [("le", bound)])} {total}'
+            yield f'{self.name}_sum{self._labels(labels)} {data[-1]}'
+            yield f'{self.name}_count{self._labels(labels)} {total}'
+
+def render_metrics():
+    return '\n'.join(line for metric in metrics_registry for line in metric.render()) + '\n'
+
+def collect_progress():
+    progress = collector.progress
+    running = progress is not None and progress["finished_at"] is None
+    return {(): progress["total"] - progress["done"] if running else 0}
+
+GITHUB_REQUEST_SECONDS = Histogram("github_request_seconds", "Длительность запроса к GitHub API", ("endpoint",),
+                                   phase="network")
+GITHUB_RESPONSES = Counter("github_responses_total", "Ответы GitHub API по коду статуса", ("endpoint", "status"))
+GITHUB_ERRORS = Counter("github_request_errors_total", "Запросы к GitHub API без ответа (сеть, таймаут)", ("endpoint",))
+GITHUB_BACKOFFS = Counter("github_rate_limit_backoffs_total", "Паузы из-за rate limit GitHub", ("resource",))
+GITHUB_REMAINING = Gauge(
+    "github_rate_limit_remaining", "Остаток лимита по токену (первые символы хеша) и ресурсу", ("token", "resource"),
+    collect=lambda: {(token_hash(token)[:8], resource): remaining for token, resource, remaining in governor.budgets()},
+)
+DB_SECONDS = Histogram("sqlite_operation_seconds", "Длительность операции с SQLite", ("operation",), phase="db")
+COLLECT_RESULTS = Counter("collect_repos_total", "Собранные репозитории по результату", ("result",))
+COLLECT_RUN_SECONDS = Gauge("collect_last_run_seconds", "Длительность последнего прогона сбора")
+COLLECT_IN_PROGRESS = Gauge("collect_in_progress", "Репозитории текущего прогона, еще не собранные", collect=collect_progress)
+COLLECT_DUE = Gauge("collect_due_repos", "Репозитории с наступившим сбором", collect=lambda: {(): count_due_repos()})
+WRITE_BUFFER_PENDING = Gauge("stats_write_buffer_pending", "Снимки в буфере до записи в БД",
+                             collect=lambda: {(): len(write_buffer)})
+EVENTS_SUBSCRIBERS = Gauge("events_subscribers", "Открытые потоки /events", collect=lambda: {(): len(broker)})
+LOOP_LAG_SECONDS = Histogram("event_loop_lag_seconds", "Опоздание цикла событий относительно таймера",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+def db_timed(func):
+    """Время операции с SQLite в sqlite_operation_seconds под именем функции"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, func.__name__)
+    return wrapper
+
+class LoopLagMonitor:
+    """Фоновая задача: насколько позже запланированного просыпается цикл событий"""
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    async def _loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            LOOP_LAG_SECONDS.observe(max(time.perf_counter() - started - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+loop_monitor = LoopLagMonitor()
+
+# ==================== ПРОФИЛИРОВАНИЕ ====================
+# Профиль включается заголовком X-Profile со значением PROFILE_TOKEN или PROFILE_COLLECT=1 для прогонов сбора.
+# Выключенный стоит одного ContextVar.get в таймерах метрик; без PROFILE_TOKEN middleware не регистрируется.
+_profile_phases = contextvars.ContextVar("profile_phases", default=None)
+
+def record_phase(phase, seconds):
+    """Добавляет время операции к фазе текущего профиля, если он идет в этом контексте"""
+    phases = _profile_phases.get()
+    if phases is not None:
+        entry = phases.setdefault(phase, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик: отдельный поток снимает стек целевого потока через sys._current_frames()"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = {}
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            key = tuple(reversed(stack))
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def write_profile(name, label, profiler, phases, wall):
+    """Пишет в PROFILE_DIR свернутые стеки (flamegraph.pl), speedscope JSON и разбивку по фазам"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, name)
+
+    with open(f"{base}.folded", "w") as f:
+        for stack, count in profiler.samples.items():
+            f.write(';'.join(f"{func} ({os.path.basename(file)}:{line})" for func, file, line in stack) + f" {count}\n")
+
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in profiler.samples.items():
+        ids = []
+        for func, file, line in stack:
+            if (func, file, line) not in index:
+                index[(func, file, line)] = len(frames)
+                frames.append({"name": func, "file": file, "line": line})
+            ids.append(index[(func, file, line)])
+        samples.append(ids)
+        weights.append(count * profiler.interval)
+    with open(f"{base}.speedscope.json", "w") as f:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": label,
+            "exporter": "github-analytics",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": label, "unit": "seconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+            }],
+        }, f)
+
+    # Фазы параллельных задач перекрываются, поэтому их сумма может превышать wall_seconds
+    with open(f"{base}.phases.json", "w") as f:
+        json.dump({
+            "label": label,
+            "wall_seconds": round(wall, 6),
+            "samples": sum(profiler.samples.values()),
+            "phases": {phase: {"seconds": round(seconds, 6), "calls": calls} for phase, (seconds, calls) in phases.items()},
+        }, f, ensure_ascii=False, indent=2)
+
+@contextmanager
+def profiling(label):
+    """Профилирует блок в потоке цикла событий; отдает имя файлов профиля в PROFILE_DIR"""
+    slug = ''.join(c if c.isalnum() else '-' for c in label).strip('-')
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{slug}-{secrets.token_hex(3)}"
+    phases = {}
+    context_token = _profile_phases.set(phases)
+    profiler = SamplingProfiler()
+    profiler.start()
+    started = time.perf_counter()
+    try:
+        yield name
+    finally:
+        profiler.stop()
+        _profile_phases.reset(context_token)
+        write_profile(name, label, profiler, phases, time.perf_counter() - started)
+        print(f"🔬 Профиль {label}: {PROFILE_DIR}/{name}.*")
+
+def is_profile_request(request):
+    header = request.headers.get("x-profile")
+    return bool(PROFILE_TOKEN and header and secrets.compare_digest(header, PROFILE_TOKEN))
+
+class ProfiledJSONResponse(JSONResponse):
+    """JSON-ответ, время сериализации которого попадает в фазу serialization профиля"""
+
+    def render(self, content):
+        if _profile_phases.get() is None:
+            return super().render(content)
+        started = time.perf_counter()
+        try:
+            return super().render(content)
+        finally:
+            record_phase("serialization", time.perf_counter() - started)
 
 # ==================== БАЗА ДАННЫХ ====================
-def init_db():
-    if os.path.exists(DATABASE_PATH):
-        os.remove(DATABASE_PATH)
-    
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.executescript('''
-        CREATE TABLE user_tokens (
+def token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+
+def open_db():
+    """Новое соединение с настроенными pragma; WAL позволяет читателям не ждать записи"""
+    conn = sqlite3.connect(DATABASE_PATH, cached_statements=512, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.create_function('token_hash', 1, token_hash, deterministic=True)
+    return conn
+
+def get_db():
+    """Соединение текущего потока: открывается один раз, подготовленные запросы кешируются в нем"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = open_db()
+        _db_local.conn = conn
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+def close_db():
+    with _db_connections_lock:
+        for conn in _db_connections:
+            conn.close()
+        _db_connections.clear()
+    _db_local.__dict__.clear()
+
+@contextmanager
+def background_transaction(conn, paced, operation):
+    """Транзакция массовой записи, время которой (без паузы) идет в sqlite_operation_seconds под operation;
+    paced — с паузой после нее, чтобы запись цикла событий не голодала"""
+    # busy handler SQLite повторяет попытку с шагом до 10 мс в начале ожидания и не больше уже прошедшего
+    # ожидания дальше. Пауза не короче транзакции и этого шага, поэтому писатель, ждавший блокировку,
+    # успевает взять ее до следующей пачки, а не упирается в busy_timeout. В командной строке
+    # ждать некому — там пауза только замедляла бы загрузку
+    started = time.monotonic()
+    with DB_SECONDS.time(operation), conn:
+        yield conn.cursor()
+    if paced:
+        time.sleep(max(time.monotonic() - started, 0.01))
+
+# Миграции применяются по порядку, номер последней хранится в PRAGMA user_version.
+# Уже выпущенные миграции не меняются — только добавляются новые в конец списка.
+# Недельные и месячные свертки: суммы трафика и новых звезд, максимумы звезд и форков
+ROLLUP_PERIODS = {
+    "week": "date({col}, 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m-01', {col})",
+}
+
+def rollup_sql(period, where=""):
+    """Пересчет сверток периода из сырых таблиц; where сужает выборку ({col} — колонка дня)"""
+    bucket = ROLLUP_PERIODS[period]
+    return f'''
+        INSERT OR REPLACE INTO rollup_{period}
+        (owner, repo_name, bucket, views, unique_visitors, clones, unique_clones, stars, forks, new_stars)
+        SELECT owner, repo_name, bucket, SUM(views), SUM(unique_visitors), SUM(clones), SUM(unique_clones),
+               MAX(stars), MAX(forks), SUM(new_stars)
+        FROM (
+            SELECT owner, repo_name, {bucket.format(col='day')} AS bucket,
+                   views, unique_visitors, clones, unique_clones, NULL AS stars, NULL AS forks, NULL AS new_stars
+            FROM traffic_daily {where.format(col='day')}
+            UNION ALL
+            SELECT owner, repo_name, {bucket.format(col='date')}, NULL, NULL, NULL, NULL, stars, forks, NULL
+            FROM repo_stats {where.format(col='date')}
+            UNION ALL
+            SELECT owner, repo_name, {bucket.format(col='day')}, NULL, NULL, NULL, NULL, NULL, NULL, stars
+            FROM star_history {where.format(col='day')}
+        )
+        GROUP BY owner, repo_name, bucket
+    '''
+
+MIGRATIONS = [
+    # 1: исходная схема (IF NOT EXISTS — базы старых версий принимаются как есть)
+    '''
+        CREATE TABLE IF NOT EXISTS user_tokens (
             session_id TEXT UNIQUE NOT NULL,
             github_token TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         
-        CREATE TABLE tracked_repos (
+        CREATE TABLE IF NOT EXISTS tracked_repos (
             session_id TEXT NOT NULL,
             owner TEXT NOT NULL,
             repo_name TEXT NOT NULL,
             UNIQUE(session_id, owner, repo_name)
         );
         
-        CREATE TABLE repo_stats (
+        CREATE TABLE IF NOT EXISTS repo_stats (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             owner TEXT NOT NULL,
             repo_name TEXT NOT NULL,
@@ -45,986 +441,1770 @@ def init_db():
             collected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             UNIQUE(owner, repo_name, date)
         );
-    ''')
+    ''',
+    # 2: расписание сбора, посуточный трафик, история звезд, доступы токенов, кеш ETag
+    '''
+        ALTER TABLE tracked_repos ADD COLUMN next_due_at TIMESTAMP;
+        ALTER TABLE tracked_repos ADD COLUMN last_success_at TIMESTAMP;
+        
+        CREATE INDEX idx_tracked_repos_due ON tracked_repos(next_due_at);
+        
+        CREATE TABLE traffic_daily (
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            day DATE NOT NULL,
+            views INTEGER DEFAULT 0,
+            unique_visitors INTEGER DEFAULT 0,
+            clones INTEGER DEFAULT 0,
+            unique_clones INTEGER DEFAULT 0,
+            PRIMARY KEY (owner, repo_name, day)
+        ) WITHOUT ROWID;
+        
+        CREATE TABLE star_history (
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            day DATE NOT NULL,
+            stars INTEGER DEFAULT 0,
+            PRIMARY KEY (owner, repo_name, day)
+        ) WITHOUT ROWID;
+        
+        CREATE TABLE star_backfill (
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            cursor TEXT,
+            processed INTEGER DEFAULT 0,
+            status TEXT NOT NULL,
+            error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (owner, repo_name)
+        );
+        
+        CREATE TABLE repo_access (
+            token_hash TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            can_push INTEGER NOT NULL,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (token_hash, owner, repo_name)
+        );
+        
+        CREATE TABLE http_cache (
+            url TEXT NOT NULL,
+            token_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            body TEXT NOT NULL,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (url, token_hash)
+        );
+    ''',
+    # 3: отдельный признак доступа на чтение, чтобы помнить 403/404 по метаданным
+    '''
+        ALTER TABLE repo_access ADD COLUMN can_read INTEGER NOT NULL DEFAULT 1;
+    ''',
+    # 4: покрывающий индекс для истории звезд и форков — агрегация без обращения к таблице
+    '''
+        CREATE INDEX idx_repo_stats_history ON repo_stats(owner, repo_name, date, stars, forks);
+    ''',
+    # 5: свертки по неделям и месяцам, заполняются из уже накопленных данных
+    '''
+        CREATE TABLE rollup_week (
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            bucket DATE NOT NULL,
+            views INTEGER,
+            unique_visitors INTEGER,
+            clones INTEGER,
+            unique_clones INTEGER,
+            stars INTEGER,
+            forks INTEGER,
+            new_stars INTEGER,
+            PRIMARY KEY (owner, repo_name, bucket)
+        ) WITHOUT ROWID;
+        CREATE TABLE rollup_month (
+            owner TEXT NOT NULL,
+            repo_name TEXT NOT NULL,
+            bucket DATE NOT NULL,
+            views INTEGER,
+            unique_visitors INTEGER,
+            clones INTEGER,
+            unique_clones INTEGER,
+            stars INTEGER,
+            forks INTEGER,
+            new_stars INTEGER,
+            PRIMARY KEY (owner, repo_name, bucket)
+        ) WITHOUT ROWID;
+        
+        INSERT OR REPLACE INTO rollup_week
+        (owner, repo_name, bucket, views, unique_visitors, clones, unique_clones, stars, forks, new_stars)
+        SELECT owner, repo_name, bucket, SUM(views), SUM(unique_visitors), SUM(clones), SUM(unique_clones),
+               MAX(stars), MAX(forks), SUM(new_stars)
+        FROM (
+            SELECT owner, repo_name, date(day, 'weekday 0', '-6 days') AS bucket,
+                   views, unique_visitors, clones, unique_clones, NULL AS stars, NULL AS forks, NULL AS new_stars
+            FROM traffic_daily
+            UNION ALL
+            SELECT owner, repo_name, date(date, 'weekday 0', '-6 days'), NULL, NULL, NULL, NULL, stars, forks, NULL
+            FROM repo_stats
+            UNION ALL
+            SELECT owner, repo_name, date(day, 'weekday 0', '-6 days'), NULL, NULL, NULL, NULL, NULL, NULL, stars
+            FROM star_history
+        )
+        GROUP BY owner, repo_name, bucket;
+        
+        INSERT OR REPLACE INTO rollup_month
+        (owner, repo_name, bucket, views, unique_visitors, clones, unique_clones, stars, forks, new_stars)
+        SELECT owner, repo_name, bucket, SUM(views), SUM(unique_visitors), SUM(clones), SUM(unique_clones),
+               MAX(stars), MAX(forks), SUM(new_stars)
+        FROM (
+            SELECT owner, repo_name, strftime('%Y-%m-01', day) AS bucket,
+                   views, unique_visitors, clones, unique_clones, NULL AS stars, NULL AS forks, NULL AS new_stars
+            FROM traffic_daily
+            UNION ALL
+            SELECT owner, repo_name, strftime('%Y-%m-01', date), NULL, NULL, NULL, NULL, stars, forks, NULL
+            FROM repo_stats
+            UNION ALL
+            SELECT owner, repo_name, strftime('%Y-%m-01', day), NULL, NULL, NULL, NULL, NULL, NULL, stars
+            FROM star_history
+        )
+        GROUP BY owner, repo_name, bucket;
+    ''',
+]
+
+def init_db():
+    """Открывает существующую базу и применяет только недостающие миграции"""
+    conn = get_db()
+    cursor = conn.cursor()
     
-    conn.commit()
-    conn.close()
-    print("✅ База пересоздана с правильной структурой")
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for number in range(version + 1, len(MIGRATIONS) + 1):
+        # Каждая миграция атомарна вместе с записью своего номера
+        cursor.executescript(f'''
+            BEGIN;
+            {MIGRATIONS[number - 1]}
+            PRAGMA user_version = {number};
+            COMMIT;
+        ''')
+        print(f"✅ Миграция БД {number} применена")
 
 init_db()
 
+@db_timed
 def save_token(session_id, token):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR REPLACE INTO user_tokens (session_id, github_token) VALUES (?, ?)', (session_id, token))
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT OR REPLACE INTO user_tokens (session_id, github_token) VALUES (?, ?)', (session_id, token))
 
+@db_timed
 def get_token(session_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT github_token FROM user_tokens WHERE session_id = ?', (session_id,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
+@db_timed
 def add_tracked_repo(session_id, owner, repo):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('INSERT OR IGNORE INTO tracked_repos VALUES (?, ?, ?)', (session_id, owner, repo))
-    conn.commit()
-    conn.close()
-
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        # Новая подписка наследует расписание репозитория, чтобы не вызвать внеочередной сбор
+        cursor.execute('''
+            INSERT OR IGNORE INTO tracked_repos (session_id, owner, repo_name, next_due_at, last_success_at)
+            SELECT ?, ?, ?, MAX(next_due_at), MAX(last_success_at)
+            FROM tracked_repos WHERE owner = ? AND repo_name = ?
+        ''', (session_id, owner, repo, owner, repo))
+
+@db_timed
 def get_tracked_repos(session_id):
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute('SELECT owner, repo_name FROM tracked_repos WHERE session_id = ?', (session_id,))
     repos = cursor.fetchall()
-    conn.close()
     return [{"owner": r[0], "name": r[1]} for r in repos]
 
-def save_stats(owner, repo, stats):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+# Сколько строк реально записано и сколько пропущено, потому что значения не изменились
+storage_counters = {"stats_written": 0, "stats_skipped": 0, "daily_written": 0, "daily_skipped": 0}
+
+def count_write(kind, written, total):
+    storage_counters[f"{kind}_written"] += written
+    storage_counters[f"{kind}_skipped"] += total - written
+
+TRAFFIC_FIELDS = ('views', 'unique_visitors', 'clones', 'unique_clones')
+
+def has_traffic(stats):
+    """Результат с трафиком; без push-доступа токена трафик неизвестен и равен None"""
+    return stats['views'] is not None
+
+def write_stats(cursor, owner, repo, stats):
+    """Снимок и посуточный трафик репозитория в текущей транзакции"""
+    today = datetime.now().date().isoformat()
+    if not has_traffic(stats):
+        write_metadata(cursor, owner, repo, today, stats)
+        if cursor.rowcount:
+            update_rollups(cursor, owner, repo, [today])
+        return
+    # Строка обновляется на месте и только если значения изменились: без удаления и
+    # повторной вставки, без расхода AUTOINCREMENT и лишних записей в индекс и WAL
     cursor.execute('''
-        INSERT OR REPLACE INTO repo_stats 
+        INSERT INTO repo_stats 
         (owner, repo_name, date, views, unique_visitors, clones, unique_clones, stars, forks)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(owner, repo_name, date) DO UPDATE SET
+            views = excluded.views,
+            unique_visitors = excluded.unique_visitors,
+            clones = excluded.clones,
+            unique_clones = excluded.unique_clones,
+            stars = excluded.stars,
+            forks = excluded.forks,
+            collected_at = CURRENT_TIMESTAMP
+        WHERE (views, unique_visitors, clones, unique_clones, stars, forks)
+            IS NOT (excluded.views, excluded.unique_visitors, excluded.clones,
+                    excluded.unique_clones, excluded.stars, excluded.forks)
     ''', (
-        owner, repo, datetime.now().date(),
+        owner, repo, today,
         stats['views'], stats['unique_visitors'],
         stats['clones'], stats['unique_clones'],
         stats['stars'], stats['forks']
     ))
-    conn.commit()
-    conn.close()
+    count_write('stats', cursor.rowcount, 1)
+    changed = [today] if cursor.rowcount else []
+    if stats.get('daily') and save_daily_traffic(cursor, owner, repo, stats['daily']):
+        changed += [day['day'] for day in stats['daily']]
+    if changed:
+        update_rollups(cursor, owner, repo, changed)
+
+def write_metadata(cursor, owner, repo, today, stats):
+    """Только звезды и форки: трафик снимка, общего для всех подписчиков, не трогаем"""
+    # Новая строка дня наследует трафик предыдущего снимка — нули затерли бы его у подписчиков с push
+    cursor.execute('''
+        INSERT INTO repo_stats
+        (owner, repo_name, date, views, unique_visitors, clones, unique_clones, stars, forks)
+        SELECT :owner, :repo, :today, prev.views, prev.unique_visitors, prev.clones, prev.unique_clones,
+               :stars, :forks
+        FROM (SELECT 1) LEFT JOIN (
+            SELECT views, unique_visitors, clones, unique_clones FROM repo_stats
+            WHERE owner = :owner AND repo_name = :repo AND date < :today
+            ORDER BY date DESC LIMIT 1
+        ) prev
+        WHERE true
+        ON CONFLICT(owner, repo_name, date) DO UPDATE SET
+            stars = excluded.stars,
+            forks = excluded.forks,
+            collected_at = CURRENT_TIMESTAMP
+        WHERE (stars, forks) IS NOT (excluded.stars, excluded.forks)
+    ''', {"owner": owner, "repo": repo, "today": today, "stars": stats['stars'], "forks": stats['forks']})
+    count_write('stats', cursor.rowcount, 1)
+
+# Счетчики за день со временем только растут, поэтому MAX делает повторную загрузку идемпотентной
+TRAFFIC_DAILY_UPSERT = '''
+    INSERT INTO traffic_daily (owner, repo_name, day, views, unique_visitors, clones, unique_clones)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(owner, repo_name, day) DO UPDATE SET
+        views = MAX(views, excluded.views),
+        unique_visitors = MAX(unique_visitors, excluded.unique_visitors),
+        clones = MAX(clones, excluded.clones),
+        unique_clones = MAX(unique_clones, excluded.unique_clones)
+    WHERE excluded.views > views OR excluded.unique_visitors > unique_visitors
+        OR excluded.clones > clones OR excluded.unique_clones > unique_clones
+'''
+
+def save_daily_traffic(cursor, owner, repo, daily):
+    """Пишет посуточную разбивку трафика одним executemany в текущей транзакции"""
+    cursor.executemany(TRAFFIC_DAILY_UPSERT, [
+        (owner, repo, day['day'], day['views'], day['unique_visitors'], day['clones'], day['unique_clones'])
+        for day in daily
+    ])
+    count_write('daily', cursor.rowcount, len(daily))
+    return cursor.rowcount
+
+def rollup_bucket(period, day):
+    """Первый день недели или месяца, в который попадает день"""
+    day = date.fromisoformat(str(day)[:10])
+    return (day - timedelta(days=day.weekday()) if period == "week" else day.replace(day=1)).isoformat()
+
+def update_rollups(cursor, owner, repo, days):
+    """Пересчитывает в текущей транзакции только те недели и месяцы, в которые попали измененные дни"""
+    for period in ROLLUP_PERIODS:
+        last = date.fromisoformat(rollup_bucket(period, max(days)))
+        if period == "week":
+            end = last + timedelta(days=6)
+        else:
+            end = (last + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        # Границы — целые периоды, поэтому сырые строки читаются узким диапазоном первичного ключа
+        cursor.execute(
+            rollup_sql(period, "WHERE owner = :owner AND repo_name = :repo AND {col} BETWEEN :start AND :end"),
+            {"owner": owner, "repo": repo, "start": rollup_bucket(period, min(days)), "end": end.isoformat()},
+        )
+
+def rebuild_rollups(repos=None, paced=False):
+    """Полный пересчет сверток — всех или только для списка (owner, repo); paced — по транзакции на репозиторий"""
+    conn = get_db()
+    if repos is None:
+        # Все свертки (команда rebuild-rollups) — одним запросом на период, без пауз и обхода по репозиториям
+        with background_transaction(conn, False, 'rebuild_rollups') as cursor:
+            for period in ROLLUP_PERIODS:
+                cursor.execute(f'DELETE FROM rollup_{period}')
+                cursor.execute(rollup_sql(period))
+        return
+    # Без пауз репозитории пересчитываются крупными транзакциями по ROLLUP_REBUILD_BATCH
+    repos = list(repos)
+    step = 1 if paced else ROLLUP_REBUILD_BATCH
+    for start in range(0, len(repos), step):
+        with background_transaction(conn, paced, 'rebuild_rollups') as cursor:
+            for owner, repo in repos[start:start + step]:
+                for period in ROLLUP_PERIODS:
+                    cursor.execute(f'DELETE FROM rollup_{period} WHERE owner = ? AND repo_name = ?', (owner, repo))
+                    cursor.execute(
+                        rollup_sql(period, "WHERE owner = :owner AND repo_name = :repo"),
+                        {"owner": owner, "repo": repo},
+                    )
+
+# views..unique_clones — суммы GitHub за 14 дней на момент снимка, они пишутся в repo_stats.
+# daily_* (необязательные) — трафик за сам день date: он пишется в traffic_daily, откуда его
+# читают /history и свертки. Без daily_* импорт не меняет посуточный трафик
+IMPORT_COUNTERS = ('views', 'unique_visitors', 'clones', 'unique_clones', 'stars', 'forks')
+IMPORT_DAILY = ('daily_views', 'daily_unique_visitors', 'daily_clones', 'daily_unique_clones')
+
+def parse_import_row(row):
+    """Проверяет строку снимка (формат /export) и приводит ее к параметрам вставки снимка и трафика дня"""
+    if isinstance(row, str):
+        row = json.loads(row)
+    owner, repo = str(row.get('owner') or '').strip(), str(row.get('repo_name') or '').strip()
+    if not owner or not repo:
+        raise ValueError("нужны owner и repo_name")
+    day = date.fromisoformat(str(row.get('date') or '')[:10]).isoformat()
+    # Пустой трафик — неизвестный (снимок без push-доступа в /export), а не нулевой: он остается NULL
+    counters = [
+        None if name in TRAFFIC_FIELDS and row.get(name) in (None, '') else int(row.get(name) or 0)
+        for name in IMPORT_COUNTERS
+    ]
+    if any(value is not None and value < 0 for value in counters):
+        raise ValueError("отрицательный счетчик")
+    daily = [row.get(name) for name in IMPORT_DAILY]
+    if any(value not in (None, '') for value in daily):
+        daily = [int(value or 0) for value in daily]
+        if min(daily) < 0:
+            raise ValueError("отрицательный счетчик")
+        daily = (owner, repo, day, *daily)
+    else:
+        daily = None
+    collected_at = row.get('collected_at') or None
+    if collected_at:
+        collected_at = datetime.fromisoformat(str(collected_at)).strftime('%Y-%m-%d %H:%M:%S')
+    return (owner, repo, day, *counters, collected_at), daily
+
+def read_import_rows(stream, fmt):
+    """Построчно читает CSV или NDJSON, не загружая файл целиком"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    # JSON разбирается при проверке строки, чтобы битая строка отклонялась, а не обрывала импорт
+    for line in stream:
+        if line.strip():
+            yield line
+
+_import_lock = threading.Lock()
+
+# Импорт целиком не db_timed: разбор CSV/JSON — не время SQLite, а вложенные has_push_access и
+# rebuild_rollups учитывались бы дважды. В фазу db идут только пачки записи и проверки доступа
+
+def import_stats(stream, fmt, token=None, paced=False):
+    """Массовая загрузка снимков пачками по IMPORT_BATCH строк в транзакции на пачку;
+    paced — пачками по IMPORT_PACED_BATCH с паузами для записей цикла событий (импорт через API)"""
+    # С токеном (импорт через API) принимаются только репозитории с подтвержденным push-доступом
+    access = {}
+    touched = set()
+    errors = []
+    imported = rejected = 0
+    started = time.monotonic()
+    conn = get_db()
+    batch_size = IMPORT_PACED_BATCH if paced else IMPORT_BATCH
+
+    def flush(batch, daily):
+        # С paced пачки импорта чередуются с записями цикла событий, а не занимают блокировку подряд.
+        # Неизвестный (NULL) трафик не затирает уже сохраненный
+        with background_transaction(conn, paced, 'import_batch') as cursor:
+            cursor.executemany('''
+                INSERT INTO repo_stats
+                (owner, repo_name, date, views, unique_visitors, clones, unique_clones, stars, forks, collected_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ON CONFLICT(owner, repo_name, date) DO UPDATE SET
+                    views = COALESCE(excluded.views, views),
+                    unique_visitors = COALESCE(excluded.unique_visitors, unique_visitors),
+                    clones = COALESCE(excluded.clones, clones),
+                    unique_clones = COALESCE(excluded.unique_clones, unique_clones),
+                    stars = excluded.stars,
+                    forks = excluded.forks,
+                    collected_at = excluded.collected_at
+                WHERE (views, unique_visitors, clones, unique_clones, stars, forks)
+                    IS NOT (COALESCE(excluded.views, views), COALESCE(excluded.unique_visitors, unique_visitors),
+                            COALESCE(excluded.clones, clones), COALESCE(excluded.unique_clones, unique_clones),
+                            excluded.stars, excluded.forks)
+            ''', batch)
+            cursor.executemany(TRAFFIC_DAILY_UPSERT, daily)
+
+    with _import_lock:
+        try:
+            batch, daily = [], []
+            for number, row in enumerate(read_import_rows(stream, fmt), 1):
+                try:
+                    values, day_traffic = parse_import_row(row)
+                except (ValueError, TypeError, AttributeError) as e:
+                    rejected += 1
+                    if len(errors) < 10:
+                        errors.append(f"строка {number}: {e}")
+                    continue
+                repo = values[:2]
+                if token is not None:
+                    if repo not in access:
+                        access[repo] = has_push_access(*repo, token)
+                    if not access[repo]:
+                        rejected += 1
+                        if len(errors) < 10:
+                            errors.append(f"строка {number}: нет доступа к {repo[0]}/{repo[1]}")
+                        continue
+                touched.add(repo)
+                batch.append(values)
+                if day_traffic:
+                    daily.append(day_traffic)
+                if len(batch) >= batch_size:
+                    flush(batch, daily)
+                    imported += len(batch)
+                    batch, daily = [], []
+            if batch:
+                flush(batch, daily)
+                imported += len(batch)
+        finally:
+            # Свертки пересчитываются один раз на репозиторий, а не на каждую строку
+            if touched:
+                rebuild_rollups(touched, paced)
+
+    seconds = time.monotonic() - started
+    return {
+        "imported": imported,
+        "rejected": rejected,
+        "errors": errors,
+        "repos": len(touched),
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(imported / seconds) if seconds else imported,
+    }
+
+def import_format(filename, fmt=None):
+    """Формат импорта: явный или по расширению файла (.csv, .ndjson/.jsonl, опционально .gz)"""
+    name = filename.lower().removesuffix('.gz')
+    fmt = fmt or ('csv' if name.endswith('.csv') else 'ndjson' if name.endswith(('.ndjson', '.jsonl')) else None)
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError("формат импорта: csv или ndjson")
+    return fmt
+
+def open_import_stream(fileobj, filename):
+    """Текстовый поток поверх файла, .gz распаковывается на лету"""
+    if filename.lower().endswith('.gz'):
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+@db_timed
+def get_cached_response(url, token):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT etag, last_modified, body FROM http_cache WHERE url = ? AND token_hash = ?', (url, token_hash(token)))
+    result = cursor.fetchone()
+    return result
 
-# ==================== GITHUB API ====================
-def get_github_stats(owner, repo, token):
-    headers = {'Authorization': f'token {token}', 'Accept': 'application/vnd.github.v3+json'}
-    base_url = f"https://api.github.com/repos/{owner}/{repo}"
+@db_timed
+def has_push_access(owner, repo, token):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT can_push FROM repo_access WHERE token_hash = ? AND owner = ? AND repo_name = ?',
+        (token_hash(token), owner, repo)
+    )
+    result = cursor.fetchone()
+    return bool(result and result[0])
+
+@db_timed
+def get_repo_access(owner, repo, token):
+    """Подтвержденный доступ токена к репозиторию: (can_read, can_push) или None, если не проверялся"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT can_read, can_push FROM repo_access WHERE token_hash = ? AND owner = ? AND repo_name = ?',
+        (token_hash(token), owner, repo)
+    )
+    return cursor.fetchone()
+
+@db_timed
+def get_latest_stats(owner, repo):
+    """Последний сохраненный снимок репозитория и его возраст в секундах"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    # collected_at двигается только при изменении данных, поэтому и время обновления, и возраст
+    # считаем от последнего успешного сбора из расписания (оно хранится в локальном времени)
+    cursor.execute('''
+        SELECT owner, repo_name, stars, forks, views, unique_visitors, clones, unique_clones,
+               strftime('%Y-%m-%dT%H:%M:%SZ', updated_at) AS collected_at,
+               (julianday('now') - julianday(updated_at)) * 86400 AS age
+        FROM (
+            SELECT *, MAX(collected_at, COALESCE((SELECT datetime(MAX(last_success_at), 'utc') FROM tracked_repos
+                                                  WHERE owner = ? AND repo_name = ?), '')) AS updated_at
+            FROM repo_stats
+            WHERE owner = ? AND repo_name = ?
+            ORDER BY date DESC
+            LIMIT 1
+        )
+    ''', (owner, repo, owner, repo))
+    result = cursor.fetchone()
+    return dict(result) if result else None
+
+@db_timed
+def get_dashboard(session_id, token, limit, offset):
+    """Последние снимки всех репозиториев сессии постранично и их общее число"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    # Снимок отдаем только при подтвержденном доступе токена сессии, как и кеш /stats:
+    # звезды и форки — с доступом на чтение, трафик — только с push. Время обновления — как в /stats:
+    # последний успешный сбор, даже если данные с тех пор не менялись
+    cursor.execute('''
+        SELECT tr.owner, tr.repo_name, rs.stars, rs.forks,
+               CASE WHEN ra.can_push THEN rs.views END AS views,
+               CASE WHEN ra.can_push THEN rs.unique_visitors END AS unique_visitors,
+               CASE WHEN ra.can_push THEN rs.clones END AS clones,
+               CASE WHEN ra.can_push THEN rs.unique_clones END AS unique_clones,
+               strftime('%Y-%m-%dT%H:%M:%SZ',
+                        MAX(rs.collected_at, COALESCE(datetime(tr.last_success_at, 'utc'), ''))) AS collected_at
+        FROM tracked_repos tr
+        LEFT JOIN repo_access ra
+            ON ra.token_hash = ? AND ra.owner = tr.owner AND ra.repo_name = tr.repo_name AND ra.can_read = 1
+        LEFT JOIN repo_stats rs
+            ON ra.token_hash IS NOT NULL AND rs.owner = tr.owner AND rs.repo_name = tr.repo_name
+            AND rs.date = (SELECT MAX(date) FROM repo_stats WHERE owner = tr.owner AND repo_name = tr.repo_name)
+        WHERE tr.session_id = ?
+        ORDER BY tr.owner, tr.repo_name
+        LIMIT ? OFFSET ?
+    ''', (token_hash(token) if token else None, session_id, limit, offset))
+    rows = cursor.fetchall()
     
+    repos = []
+    for row in rows:
+        stats = None
+        if row['collected_at'] is not None:
+            stats = {key: row[key] for key in ('stars', 'forks', 'views', 'unique_visitors',
+                                               'clones', 'unique_clones', 'collected_at')}
+        repos.append({"owner": row['owner'], "name": row['repo_name'], "stats": stats})
+    # Отдельный подсчет: оконный COUNT(*) видит только строки страницы и за ее концом дает 0
+    cursor.execute('SELECT COUNT(*) AS total FROM tracked_repos WHERE session_id = ?', (session_id,))
+    return {"repos": repos, "total": cursor.fetchone()['total']}
+
+@db_timed
+def get_session_push_repos(session_ids):
+    """Отслеживаемые сессиями репозитории, к которым у токена сессии подтвержден push: {session_id: {(owner, repo)}}"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT tr.session_id, tr.owner, tr.repo_name
+        FROM tracked_repos tr
+        JOIN user_tokens ut ON ut.session_id = tr.session_id
+        JOIN repo_access ra
+            ON ra.token_hash = token_hash(ut.github_token) AND ra.owner = tr.owner
+            AND ra.repo_name = tr.repo_name AND ra.can_push = 1
+        WHERE tr.session_id IN ({', '.join('?' * len(session_ids))})
+    ''', session_ids)
+    repos = {}
+    for session_id, owner, repo in cursor.fetchall():
+        repos.setdefault(session_id, set()).add((owner, repo))
+    return repos
+
+EXPORT_COLUMNS = ('owner', 'repo_name', 'date', 'views', 'unique_visitors', 'clones', 'unique_clones',
+                  'stars', 'forks', 'collected_at', *IMPORT_DAILY)
+
+def iter_export(session_id, token, repos, start, end, fmt, compress=False):
+    """Снимки репозиториев сессии кусками по EXPORT_BATCH строк — память не зависит от объема выгрузки"""
+    # Отдельное соединение: курсор живет все время отдачи и не мешает запросам потока
+    conn = open_db()
     try:
-        response = requests.get(base_url, headers=headers)
+        repo_filter = ''
+        params = [token_hash(token), start, end, session_id]
+        if repos:
+            # Фильтр по выражению, а не по ключу индекса: так план остается обходом по порядку без сортировки
+            repo_filter = f"AND tr.owner || '/' || tr.repo_name IN ({', '.join('?' * len(repos))})"
+            params += repos
+        # Порядок совпадает с индексами обеих таблиц, поэтому строки идут потоком без сортировки в памяти;
+        # трафик дня — поиск по первичному ключу traffic_daily, колонки daily_* импорт читает обратно.
+        # Снимок дня последнего успешного сбора подтвержден этим сбором, даже если не изменился
+        cursor = conn.execute(f'''
+            SELECT rs.owner, rs.repo_name, rs.date, rs.views, rs.unique_visitors, rs.clones, rs.unique_clones,
+                   rs.stars, rs.forks,
+                   strftime('%Y-%m-%dT%H:%M:%SZ', CASE WHEN rs.date = date(tr.last_success_at)
+                       THEN MAX(rs.collected_at, datetime(tr.last_success_at, 'utc')) ELSE rs.collected_at END),
+                   td.views, td.unique_visitors, td.clones, td.unique_clones
+            FROM tracked_repos tr
+            JOIN repo_access ra
+                ON ra.token_hash = ? AND ra.owner = tr.owner AND ra.repo_name = tr.repo_name AND ra.can_push = 1
+            JOIN repo_stats rs
+                ON rs.owner = tr.owner AND rs.repo_name = tr.repo_name AND rs.date BETWEEN ? AND ?
+            LEFT JOIN traffic_daily td
+                ON td.owner = rs.owner AND td.repo_name = rs.repo_name AND td.day = rs.date
+            WHERE tr.session_id = ? {repo_filter}
+            ORDER BY tr.owner, tr.repo_name, rs.date
+        ''', params)
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if fmt == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH)
+            if not rows:
+                break
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                buffer.writelines(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n' for row in rows)
+            chunk = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            yield compressor.compress(chunk) if compressor else chunk
+        tail = buffer.getvalue().encode()
+        if compressor:
+            yield compressor.compress(tail) + compressor.flush()
+        elif tail:
+            yield tail
+    finally:
+        conn.close()
+
+# Метрика истории -> (таблица, колонка даты, агрегат по интервалу)
+HISTORY_METRICS = {
+    "views": ("traffic_daily", "day", "SUM(views)"),
+    "unique_visitors": ("traffic_daily", "day", "SUM(unique_visitors)"),
+    "clones": ("traffic_daily", "day", "SUM(clones)"),
+    "unique_clones": ("traffic_daily", "day", "SUM(unique_clones)"),
+    "stars": ("repo_stats", "date", "MAX(stars)"),
+    "forks": ("repo_stats", "date", "MAX(forks)"),
+    "new_stars": ("star_history", "day", "SUM(stars)"),
+}
+
+HISTORY_BUCKETS = {"day": "{col}", **ROLLUP_PERIODS}
+
+@db_timed
+def get_history(owner, repo, start, end, resolution, metrics):
+    """История метрик, агрегированная в SQL по дням/неделям/месяцам, в колоночном виде"""
+    if resolution in ROLLUP_PERIODS:
+        return get_rollup_history(owner, repo, start, end, resolution, metrics)
+
+    # Каждая таблица читается одним проходом по своему первичному или покрывающему индексу
+    tables = {}
+    for metric in metrics:
+        table, col, aggregate = HISTORY_METRICS[metric]
+        tables.setdefault((table, col), []).append((metric, aggregate))
+
+    conn = get_db()
+    cursor = conn.cursor()
+    series = {metric: {} for metric in metrics}
+    for (table, col), columns in tables.items():
+        bucket = HISTORY_BUCKETS[resolution].format(col=col)
+        cursor.execute(f'''
+            SELECT {bucket} AS bucket, {', '.join(aggregate for _, aggregate in columns)}
+            FROM {table}
+            WHERE owner = ? AND repo_name = ? AND {col} BETWEEN ? AND ?
+            GROUP BY bucket
+        ''', (owner, repo, start, end))
+        for row in cursor.fetchall():
+            for (metric, _), value in zip(columns, row[1:]):
+                series[metric][row[0]] = value
+
+    buckets = sorted(set().union(*(values.keys() for values in series.values())))
+    return {
+        "buckets": buckets,
+        "series": {metric: [values.get(b) for b in buckets] for metric, values in series.items()},
+    }
+
+def get_rollup_history(owner, repo, start, end, period, metrics):
+    """История из готовых сверток: по строке на период, крайние периоды берутся целиком"""
+    conn = get_db()
+    cursor = conn.cursor()
+    columns = ', '.join(metrics)
+    cursor.execute(f'''
+        SELECT bucket, {columns} FROM rollup_{period}
+        WHERE owner = ? AND repo_name = ? AND bucket BETWEEN ? AND ?
+            AND COALESCE({columns}, NULL) IS NOT NULL
+        ORDER BY bucket
+    ''', (owner, repo, rollup_bucket(period, start), end))
+    rows = cursor.fetchall()
+    return {
+        "buckets": [row[0] for row in rows],
+        "series": {metric: [row[i] for row in rows] for i, metric in enumerate(metrics, 1)},
+    }
+
+@db_timed
+def get_backfill_state(owner, repo):
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute('SELECT * FROM star_backfill WHERE owner = ? AND repo_name = ?', (owner, repo))
+    result = cursor.fetchone()
+    return dict(result) if result else None
+
+@db_timed
+def set_backfill_status(owner, repo, status, error=None):
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO star_backfill (owner, repo_name, status, error) VALUES (?, ?, ?, ?)
+            ON CONFLICT(owner, repo_name) DO UPDATE SET
+                status = excluded.status, error = excluded.error, updated_at = CURRENT_TIMESTAMP
+        ''', (owner, repo, status, error))
+
+@db_timed
+def save_stargazer_page(owner, repo, days, end_cursor, count):
+    """Дневные приросты звезд и курсор страницы пишутся в одной транзакции — перезапуск продолжит ровно с нее"""
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO star_history (owner, repo_name, day, stars) VALUES (?, ?, ?, ?)
+            ON CONFLICT(owner, repo_name, day) DO UPDATE SET stars = stars + excluded.stars
+        ''', [(owner, repo, day, stars) for day, stars in days.items()])
+        if days:
+            update_rollups(cursor, owner, repo, list(days))
+        cursor.execute('''
+            UPDATE star_backfill SET cursor = ?, processed = processed + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE owner = ? AND repo_name = ?
+        ''', (end_cursor, count, owner, repo))
+
+@db_timed
+def get_running_backfills():
+    """Незавершенные бэкфиллы с любым токеном сессии, отслеживающей репозиторий или с подтвержденным
+    чтением; None — продолжить некому"""
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT sb.owner, sb.repo_name, (
+            SELECT MIN(ut.github_token) FROM user_tokens ut
+            WHERE EXISTS (
+                SELECT 1 FROM tracked_repos tr
+                WHERE tr.session_id = ut.session_id AND tr.owner = sb.owner AND tr.repo_name = sb.repo_name
+            ) OR EXISTS (
+                SELECT 1 FROM repo_access ra
+                WHERE ra.token_hash = token_hash(ut.github_token) AND ra.owner = sb.owner
+                AND ra.repo_name = sb.repo_name AND ra.can_read = 1
+            )
+        )
+        FROM star_backfill sb
+        WHERE sb.status = 'running'
+    ''')
+    jobs = cursor.fetchall()
+    return jobs
+
+def next_due_time(success):
+    """Время следующего сбора: интервал с джиттером после успеха, короткая пауза после ошибки"""
+    if success:
+        delay = COLLECT_INTERVAL * (1 + random.uniform(-COLLECT_JITTER, COLLECT_JITTER))
+    else:
+        delay = COLLECT_RETRY_DELAY * (1 + random.uniform(0, COLLECT_JITTER))
+    return (datetime.now() + timedelta(seconds=delay)).isoformat(timespec='seconds')
+
+def write_schedule(cursor, owner, repo, success, reschedule=True):
+    """Расписание сбора репозитория для всех сессий, которые его отслеживают; reschedule=False —
+    только отметка успешного обновления, срок следующего сбора не меняется"""
+    if success and not reschedule:
+        cursor.execute(
+            'UPDATE tracked_repos SET last_success_at = ? WHERE owner = ? AND repo_name = ?',
+            (datetime.now().isoformat(timespec='seconds'), owner, repo)
+        )
+    elif success:
+        cursor.execute(
+            'UPDATE tracked_repos SET next_due_at = ?, last_success_at = ? WHERE owner = ? AND repo_name = ?',
+            (next_due_time(True), datetime.now().isoformat(timespec='seconds'), owner, repo)
+        )
+    else:
+        cursor.execute(
+            'UPDATE tracked_repos SET next_due_at = ? WHERE owner = ? AND repo_name = ?',
+            (next_due_time(False), owner, repo)
+        )
+
+@db_timed
+def save_collected_batch(results, access=(), responses=()):
+    """Результаты сбора, доступы токенов и ответы для кеша ETag одной транзакцией — один fsync на пачку"""
+    # results: (owner, repo, stats или None, по расписанию ли); access: (token_hash, owner, repo,
+    # can_read, can_push); responses: (url, token_hash, etag, last_modified, body)
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO repo_access (token_hash, owner, repo_name, can_read, can_push, checked_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', access)
+        cursor.executemany('''
+            INSERT OR REPLACE INTO http_cache (url, token_hash, etag, last_modified, body, fetched_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', responses)
+        for owner, repo, stats, scheduled in results:
+            if stats is not None:
+                write_stats(cursor, owner, repo, stats)
+            if scheduled:
+                write_schedule(cursor, owner, repo, stats is not None)
+            elif stats is not None:
+                # Интерактивное обновление двигает расписание только при успехе; без push обновлены
+                # только звезды и форки — снимок свежий для кеша, но сбор трафика не откладываем
+                write_schedule(cursor, owner, repo, True, reschedule=has_traffic(stats))
+
+@db_timed
+def count_due_repos():
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT COUNT(DISTINCT owner || '/' || repo_name) FROM tracked_repos
+        WHERE next_due_at IS NULL OR next_due_at <= ?
+    ''', (datetime.now().isoformat(timespec='seconds'),))
+    return cursor.fetchone()[0]
+
+@db_timed
+def get_due_repos(limit=SCHEDULER_BATCH):
+    """Репозитории с наступившим сбором: {(owner, repo): [(token, can_read, can_push), ...]} по всем подписчикам"""
+    # None — доступ этого токена к репозиторию не проверялся или проверка старше TOKEN_ACCESS_TTL
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        WITH due AS (
+            SELECT tr.owner, tr.repo_name, MIN(tr.next_due_at) AS due_at
+            FROM tracked_repos tr
+            JOIN user_tokens ut ON tr.session_id = ut.session_id
+            WHERE tr.next_due_at IS NULL OR tr.next_due_at <= ?
+            GROUP BY tr.owner, tr.repo_name
+            ORDER BY due_at
+            LIMIT ?
+        )
+        SELECT DISTINCT d.owner, d.repo_name, ut.github_token, ra.can_read, ra.can_push
+        FROM due d
+        JOIN tracked_repos tr ON tr.owner = d.owner AND tr.repo_name = d.repo_name
+        JOIN user_tokens ut ON ut.session_id = tr.session_id
+        LEFT JOIN repo_access ra
+            ON ra.token_hash = token_hash(ut.github_token) AND ra.owner = d.owner AND ra.repo_name = d.repo_name
+            AND ra.checked_at >= datetime('now', ?)
+    ''', (datetime.now().isoformat(timespec='seconds'), limit, f'-{TOKEN_ACCESS_TTL} seconds'))
+    repos = {}
+    for owner, repo, token, can_read, can_push in cursor.fetchall():
+        repos.setdefault((owner, repo), []).append((token, can_read, can_push))
+    return repos
+
+# ==================== GITHUB API ====================
+try:
+    import h2  # noqa: F401  (нужен httpx для HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class RateLimitExhausted(Exception):
+    """Бюджет токена исчерпан, а ждать сброса дольше RATE_LIMIT_MAX_WAIT; retry_after — сколько ждать, с"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limited(response):
+    """Ответ означает первичный или вторичный rate limit GitHub"""
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    if 'Retry-After' in response.headers or response.headers.get('X-RateLimit-Remaining') == '0':
+        return True
+    return 'rate limit' in response.text.lower()
+
+class TokenBudget:
+    """Бюджет одного токена: остаток из заголовков X-RateLimit-* и token bucket для равномерного расхода"""
+
+    def __init__(self, resource):
+        self.resource = resource
+        self.limit = 5000
+        self.remaining = 5000
+        self.reset_at = time.time() + 3600
+        self.blocked_until = 0.0
+        self.backoffs = 0
+        self._tokens = RATE_LIMIT_BURST
+        self._refilled_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def rate(self):
+        """Сколько запросов в секунду можно тратить, чтобы дожить до сброса с запасом"""
+        window = max(self.reset_at - time.time(), 1.0)
+        return max(self.remaining - RATE_LIMIT_RESERVE, 0) / window
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(RATE_LIMIT_BURST, self._tokens + (now - self._refilled_at) * self.rate())
+        self._refilled_at = now
+
+    def _wait_time(self):
+        now = time.time()
+        if now >= self.reset_at:
+            # Окно сброшено, до следующего ответа считаем бюджет полным
+            self.remaining = self.limit
+            self.reset_at = now + 3600
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        rate = self.rate()
+        return (1 - self._tokens) / rate if rate > 0 else self.reset_at - now
+
+    async def acquire(self):
+        # Под замком ожидающие обслуживаются по очереди и не обгоняют темп
+        async with self._lock:
+            while True:
+                wait = self._wait_time()
+                if wait <= 0:
+                    self._tokens -= 1
+                    self.remaining = max(self.remaining - 1, 0)
+                    return
+                if wait > RATE_LIMIT_MAX_WAIT:
+                    reset = datetime.fromtimestamp(time.time() + wait).isoformat(timespec='seconds')
+                    raise RateLimitExhausted(f"лимит GitHub ({self.resource}) исчерпан до {reset}", wait)
+                await asyncio.sleep(wait)
+
+    def update(self, response):
+        """Обновляет бюджет по ответу; для rate limit возвращает паузу до повтора"""
+        headers = response.headers
+        if response.status_code == 304:
+            # 304 на условный запрос лимит не расходует — возвращаем списанное в acquire,
+            # иначе бесплатные ревалидации шли бы в темпе платных запросов
+            self._tokens = min(RATE_LIMIT_BURST, self._tokens + 1)
+            self.remaining = min(self.remaining + 1, self.limit)
+        if 'X-RateLimit-Remaining' in headers:
+            self.limit = int(headers.get('X-RateLimit-Limit', self.limit))
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+            self.reset_at = float(headers.get('X-RateLimit-Reset', self.reset_at))
+
+        if not is_rate_limited(response):
+            return None
+
+        if 'Retry-After' in headers:
+            delay = float(headers['Retry-After'])
+        elif self.remaining == 0:
+            delay = self.reset_at - time.time()
+        else:
+            # Вторичный лимит без подсказки: GitHub просит ждать не меньше минуты
+            delay = 60 * 2 ** min(self.backoffs, 4)
+        delay = max(delay, 1.0)
+        self.backoffs += 1
+        self.blocked_until = max(self.blocked_until, time.time() + delay)
+        return delay
+
+    def state(self):
+        return {
+            "resource": self.resource,
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset_at": datetime.fromtimestamp(self.reset_at).isoformat(timespec='seconds'),
+            "blocked_until": datetime.fromtimestamp(self.blocked_until).isoformat(timespec='seconds') if self.blocked_until > time.time() else None,
+            "rate_per_second": round(self.rate(), 3),
+            "backoffs": self.backoffs,
+        }
+
+class RateLimitGovernor:
+    """Реестр бюджетов по (токен, ресурс GitHub API)"""
+
+    def __init__(self):
+        self._budgets = {}
+
+    def budget(self, token, resource="core"):
+        key = (token, resource)
+        if key not in self._budgets:
+            self._budgets[key] = TokenBudget(resource)
+        return self._budgets[key]
+
+    def remaining(self, token, resource="core"):
+        budget = self._budgets.get((token, resource))
+        return budget.remaining if budget else 5000
+
+    def budgets(self):
+        return [(token, resource, budget.remaining) for (token, resource), budget in self._budgets.items()]
+
+    def state(self, token):
+        return [budget.state() for (t, _), budget in self._budgets.items() if t == token]
+
+governor = RateLimitGovernor()
+
+def endpoint_label(path):
+    """Путь без owner/repo — метка метрик с ограниченным числом значений"""
+    parts = path.split('?', 1)[0].strip('/').split('/')
+    if parts[0] == 'repos' and len(parts) >= 3:
+        parts[1:3] = [':owner', ':repo']
+    return '/' + '/'.join(parts)
+
+class GitHubClient:
+    """Асинхронный клиент GitHub API с общим пулом keep-alive соединений"""
+
+    def __init__(self, base_url=GITHUB_API_URL):
+        self.base_url = base_url
+        self._client = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2_AVAILABLE,
+                timeout=GITHUB_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=GITHUB_MAX_CONNECTIONS,
+                    max_keepalive_connections=GITHUB_MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                ),
+                headers={'Accept': 'application/vnd.github.v3+json'},
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method, path, token, resource="core", headers=None, **kwargs):
+        await self.start()
+        headers = {**(headers or {}), 'Authorization': f'token {token}'}
+        budget = governor.budget(token, resource)
+        endpoint = endpoint_label(path)
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            await budget.acquire()
+            try:
+                with GITHUB_REQUEST_SECONDS.time(endpoint):
+                    response = await self._client.request(method, path, headers=headers, **kwargs)
+            except Exception:
+                GITHUB_ERRORS.inc(endpoint)
+                raise
+            GITHUB_RESPONSES.inc(endpoint, response.status_code)
+            delay = budget.update(response)
+            if delay is None or attempt == RATE_LIMIT_RETRIES:
+                return response
+            GITHUB_BACKOFFS.inc(resource)
+            print(f"⏳ Rate limit ({resource}), пауза {delay:.0f} с: {path}")
+        return response
+
+    async def graphql(self, query, variables, token):
+        response = await self.request("POST", "/graphql", token, resource="graphql",
+                                      json={"query": query, "variables": variables})
         if response.status_code != 200:
-            return {"success": False, "error": f"API error: {response.status_code}"}
-        repo_data = response.json()
-        
-        views_response = requests.get(f"{base_url}/traffic/views", headers=headers)
-        views_data = views_response.json() if views_response.status_code == 200 else {'count': 0, 'uniques': 0}
+            raise RuntimeError(f"GraphQL error: {response.status_code}")
+        return response.json()
+
+    async def get(self, path, token):
+        """GET с валидаторами ETag/Last-Modified: 304 не тратит лимит, тело берется из кеша"""
+        headers = {}
+        cached = write_buffer.cached_response(path, token) or get_cached_response(path, token)
+        if cached:
+            etag, last_modified, body = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = await self.request("GET", path, token, headers=headers)
+
+        if response.status_code == 304 and cached:
+            return httpx.Response(200, content=cached[2].encode(), headers={'Content-Type': 'application/json'},
+                                  request=response.request)
+        if response.status_code == 200:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                write_buffer.cache_response(path, token, etag, last_modified, response.text)
+        return response
+
+github = GitHubClient()
+
+def merge_daily_traffic(views, clones):
+    """Сводит массивы views[] и clones[] из traffic API в одну запись на день"""
+    days = {}
+
+    def day_row(item):
+        day = item['timestamp'][:10]
+        return days.setdefault(day, {"day": day, "views": 0, "unique_visitors": 0, "clones": 0, "unique_clones": 0})
+
+    for item in views:
+        row = day_row(item)
+        row['views'] = item.get('count', 0)
+        row['unique_visitors'] = item.get('uniques', 0)
+    for item in clones:
+        row = day_row(item)
+        row['clones'] = item.get('count', 0)
+        row['unique_clones'] = item.get('uniques', 0)
+    return [days[day] for day in sorted(days)]
+
+async def fetch_repo_metadata_batch(repos, token):
+    """Звезды и форки для пачки репозиториев одним GraphQL-запросом с алиасами"""
+    params = ', '.join(f'$o{i}: String!, $n{i}: String!' for i in range(len(repos)))
+    fields = ' '.join(
+        f'r{i}: repository(owner: $o{i}, name: $n{i}) {{ stargazerCount forkCount }}' for i in range(len(repos))
+    )
+    variables = {}
+    for i, (owner, repo) in enumerate(repos):
+        variables[f'o{i}'] = owner
+        variables[f'n{i}'] = repo
+
+    result = await github.graphql(f'query({params}) {{ {fields} }}', variables, token)
+    data = result.get('data') or {}
+
+    # Репозитории, которых нет в ответе (ошибка, нет доступа), вызывающий добирает через REST
+    metadata = {}
+    for i, (owner, repo) in enumerate(repos):
+        node = data.get(f'r{i}')
+        if node:
+            metadata[(owner, repo)] = {"stars": node['stargazerCount'], "forks": node['forkCount']}
+    return metadata
+
+async def get_github_stats(owner, repo, token, metadata=None):
+    """Статистика репозитория; если звезды и форки уже получены через GraphQL, REST-запрос репозитория пропускается"""
+    base_path = f"/repos/{owner}/{repo}"
+    
+    try:
+        # Все запросы идут параллельно по одному пулу соединений
+        calls = [
+            github.get(f"{base_path}/traffic/views", token),
+            github.get(f"{base_path}/traffic/clones", token),
+        ]
+        if metadata is None:
+            calls.append(github.get(base_path, token))
+        views_response, clones_response, *repo_response = await asyncio.gather(*calls)
         
-        clones_response = requests.get(f"{base_url}/traffic/clones", headers=headers)
-        clones_data = clones_response.json() if clones_response.status_code == 200 else {'count': 0, 'uniques': 0}
+        if metadata is None:
+            response = repo_response[0]
+            if response.status_code != 200:
+                if response.status_code == 404 or (response.status_code == 403 and not is_rate_limited(response)):
+                    write_buffer.record_access(owner, repo, token, can_push=False, can_read=False)
+                return {"success": False, "error": f"API error: {response.status_code}"}
+            repo_data = response.json()
+            metadata = {"stars": repo_data.get('stargazers_count', 0), "forks": repo_data.get('forks_count', 0)}
         
+        for traffic_response in (views_response, clones_response):
+            # 404 — токен не видит репозиторий. Звезды и форки могли прийти через GraphQL другим токеном,
+            # поэтому это ошибка доступа на чтение (планировщик возьмет другой токен), а не пустой трафик
+            if traffic_response.status_code == 404:
+                write_buffer.record_access(owner, repo, token, can_push=False, can_read=False)
+                return {"success": False, "error": "Traffic API error: 404"}
+            # 403 без rate limit — нет push-доступа к трафику; остальное не подменяем нулями
+            if traffic_response.status_code != 200 and (
+                    is_rate_limited(traffic_response) or traffic_response.status_code != 403):
+                return {"success": False, "error": f"Traffic API error: {traffic_response.status_code}"}
+        can_push = views_response.status_code == 200 and clones_response.status_code == 200
+        write_buffer.record_access(owner, repo, token, can_push)
+        if can_push:
+            views_data, clones_data = views_response.json(), clones_response.json()
+            traffic = {
+                "views": views_data.get('count', 0),
+                "unique_visitors": views_data.get('uniques', 0),
+                "clones": clones_data.get('count', 0),
+                "unique_clones": clones_data.get('uniques', 0),
+                "daily": merge_daily_traffic(views_data.get('views', []), clones_data.get('clones', [])),
+            }
+        else:
+            # Трафик неизвестен, а не нулевой: нули затерли бы общий снимок у подписчиков с push
+            traffic = {**dict.fromkeys(TRAFFIC_FIELDS), "daily": []}
+
         return {
             "success": True,
             "data": {
                 "owner": owner,
                 "repo_name": repo,
-                "stars": repo_data.get('stargazers_count', 0),
-                "forks": repo_data.get('forks_count', 0),
-                "views": views_data.get('count', 0),
-                "unique_visitors": views_data.get('uniques', 0),
-                "clones": clones_data.get('count', 0),
-                "unique_clones": clones_data.get('uniques', 0),
+                "stars": metadata['stars'],
+                "forks": metadata['forks'],
+                **traffic,
                 "collected_at": datetime.now().isoformat()
             }
         }
     except Exception as e:
-        return {"success": False, "error": str(e)}
-
-# ==================== АВТО-СБОР ====================
-def auto_collect():
-    """Собирает статистику для всех отслеживаемых репозиториев"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT DISTINCT tr.owner, tr.repo_name, ut.github_token 
-        FROM tracked_repos tr
-        JOIN user_tokens ut ON tr.session_id = ut.session_id
-    ''')
-    
-    repos = cursor.fetchall()
-    conn.close()
-    
-    print(f"🤖 Авто-сбор: {len(repos)} репозиториев")
-    
-    for owner, repo, token in repos:
-        try:
-            stats = get_github_stats(owner, repo, token)
-            if stats["success"]:
-                save_stats(owner, repo, stats["data"])
-                print(f"✅ {owner}/{repo}")
-        except Exception as e:
-            print(f"❌ {owner}/{repo}: {e}")
+        return {"success": False, "error": str(e) or type(e).__name__}
 
-# ==================== ВЕБ-ИНТЕРФЕЙС ====================
-HTML = """
-<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>GitHub Analytics Dashboard</title>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
+# ==================== СОБЫТИЯ ====================
+SNAPSHOT_FIELDS = ('stars', 'forks', 'views', 'unique_visitors', 'clones', 'unique_clones')
 
-        :root {
-            --primary: #2ea44f;
-            --primary-dark: #2c974b;
-            --secondary: #0366d6;
-            --dark: #24292e;
-            --light: #f6f8fa;
-            --border: #e1e4e8;
-            --text: #24292e;
-            --text-light: #586069;
-            --success: #28a745;
-            --warning: #ffc107;
-            --danger: #dc3545;
-            --card-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-            --transition: all 0.3s ease;
-        }
+class EventBroker:
+    """Рассылка событий подписчикам /events: своя очередь на каждое соединение"""
 
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-            background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-            color: var(--text);
-            line-height: 1.6;
-            min-height: 100vh;
-        }
+    def __init__(self, queue_size=EVENTS_QUEUE_SIZE, progress_interval=EVENTS_PROGRESS_INTERVAL):
+        self.queue_size = queue_size
+        self.progress_interval = progress_interval
+        self._subscribers = {}
+        self._progress = None
+        self._progress_handle = None
 
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-        }
+    def __len__(self):
+        return sum(len(queues) for queues in self._subscribers.values())
 
-        /* Header */
-        header {
-            background: var(--dark);
-            color: white;
-            padding: 1rem 0;
-            box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-        }
+    def subscribe(self, session_id):
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(session_id, set()).add(queue)
+        return queue
 
-        .header-content {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-
-        .logo {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            font-size: 1.5rem;
-            font-weight: 700;
-        }
+    def unsubscribe(self, session_id, queue):
+        queues = self._subscribers.get(session_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[session_id]
 
-        .logo i {
-            color: var(--primary);
-        }
-
-        /* Main Layout */
-        .dashboard {
-            display: grid;
-            grid-template-columns: 1fr 300px;
-            gap: 24px;
-            margin-top: 24px;
-        }
-
-        @media (max-width: 768px) {
-            .dashboard {
-                grid-template-columns: 1fr;
-            }
-        }
-
-        /* Cards */
-        .card {
-            background: white;
-            border-radius: 12px;
-            padding: 24px;
-            box-shadow: var(--card-shadow);
-            margin-bottom: 24px;
-            transition: var(--transition);
-            border: 1px solid var(--border);
-        }
-
-        .card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 8px 24px rgba(0, 0, 0, 0.15);
-        }
-
-        .card-header {
-            display: flex;
-            align-items: center;
-            margin-bottom: 20px;
-            padding-bottom: 12px;
-            border-bottom: 1px solid var(--border);
-        }
-
-        .card-header i {
-            margin-right: 10px;
-            color: var(--primary);
-            font-size: 1.2rem;
-        }
-
-        .card-title {
-            font-size: 1.25rem;
-            font-weight: 600;
-        }
-
-        /* Forms */
-        .form-group {
-            margin-bottom: 16px;
-        }
-
-        .form-label {
-            display: block;
-            margin-bottom: 6px;
-            font-weight: 500;
-            color: var(--text-light);
-        }
-
-        .form-input {
-            width: 100%;
-            padding: 12px 16px;
-            border: 1px solid var(--border);
-            border-radius: 8px;
-            font-size: 1rem;
-            transition: var(--transition);
-        }
-
-        .form-input:focus {
-            outline: none;
-            border-color: var(--primary);
-            box-shadow: 0 0 0 3px rgba(46, 164, 79, 0.2);
-        }
-
-        .form-row {
-            display: flex;
-            gap: 12px;
-        }
-
-        .form-row .form-group {
-            flex: 1;
-        }
-
-        /* Buttons */
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            padding: 12px 20px;
-            border: none;
-            border-radius: 8px;
-            font-size: 1rem;
-            font-weight: 500;
-            cursor: pointer;
-            transition: var(--transition);
-            text-decoration: none;
-        }
-
-        .btn-primary {
-            background: var(--primary);
-            color: white;
-        }
-
-        .btn-primary:hover {
-            background: var(--primary-dark);
-            transform: translateY(-2px);
-        }
-
-        .btn-secondary {
-            background: var(--secondary);
-            color: white;
-        }
-
-        .btn-secondary:hover {
-            background: #0256b3;
-            transform: translateY(-2px);
-        }
-
-        .btn-block {
-            width: 100%;
-        }
-
-        .btn-sm {
-            padding: 8px 12px;
-            font-size: 0.875rem;
-        }
-
-        /* Stats Grid */
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(200px, 1fr));
-            gap: 16px;
-            margin-top: 16px;
-        }
-
-        .stat-card {
-            background: var(--light);
-            border-radius: 8px;
-            padding: 16px;
-            text-align: center;
-            border-left: 4px solid var(--primary);
-        }
-
-        .stat-value {
-            font-size: 1.75rem;
-            font-weight: 700;
-            color: var(--dark);
-            margin: 8px 0;
-        }
-
-        .stat-label {
-            font-size: 0.875rem;
-            color: var(--text-light);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 4px;
-        }
-
-        /* Repo Widgets */
-        .repo-widgets {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(350px, 1fr));
-            gap: 20px;
-            margin-top: 20px;
-        }
-
-        .repo-widget {
-            background: white;
-            border-radius: 12px;
-            padding: 20px;
-            box-shadow: var(--card-shadow);
-            border: 2px solid var(--border);
-            transition: var(--transition);
-            position: relative;
-        }
-
-        .repo-widget:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 6px 20px rgba(0, 0, 0, 0.15);
-            border-color: var(--primary);
-        }
-
-        .repo-widget-header {
-            display: flex;
-            justify-content: between;
-            align-items: flex-start;
-            margin-bottom: 16px;
-        }
-
-        .repo-widget-info {
-            flex: 1;
-        }
-
-        .repo-widget-name {
-            font-size: 1.1rem;
-            font-weight: 600;
-            color: var(--dark);
-            margin-bottom: 4px;
-        }
-
-        .repo-widget-owner {
-            color: var(--text-light);
-            font-size: 0.9rem;
-        }
-
-        .repo-widget-actions {
-            display: flex;
-            gap: 8px;
-        }
-
-        .repo-widget-stats {
-            display: grid;
-            grid-template-columns: repeat(3, 1fr);
-            gap: 12px;
-            margin-top: 12px;
-        }
-
-        .repo-stat {
-            text-align: center;
-            padding: 8px;
-            background: var(--light);
-            border-radius: 6px;
-        }
-
-        .repo-stat-value {
-            font-size: 1.2rem;
-            font-weight: 700;
-            color: var(--dark);
-        }
-
-        .repo-stat-label {
-            font-size: 0.75rem;
-            color: var(--text-light);
-            margin-top: 4px;
-        }
-
-        .repo-widget-updated {
-            font-size: 0.75rem;
-            color: var(--text-light);
-            margin-top: 12px;
-            text-align: center;
-        }
-
-        .refresh-btn {
-            background: transparent;
-            border: none;
-            color: var(--text-light);
-            cursor: pointer;
-            padding: 4px;
-            border-radius: 4px;
-            transition: var(--transition);
-        }
-
-        .refresh-btn:hover {
-            color: var(--primary);
-            background: var(--light);
-        }
-
-        .loading .repo-stat-value {
-            color: transparent;
-            background: linear-gradient(90deg, #f0f0f0 25%, #e0e0e0 50%, #f0f0f0 75%);
-            background-size: 200% 100%;
-            animation: loading 1.5s infinite;
-            border-radius: 4px;
-        }
-
-        @keyframes loading {
-            0% { background-position: 200% 0; }
-            100% { background-position: -200% 0; }
-        }
-
-        /* Messages */
-        .message {
-            padding: 16px;
-            border-radius: 8px;
-            margin: 16px 0;
-            display: flex;
-            align-items: center;
-            gap: 12px;
-        }
-
-        .message-success {
-            background: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-
-        .message-error {
-            background: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-
-        /* Loading */
-        .loading {
-            display: inline-block;
-            width: 20px;
-            height: 20px;
-            border: 3px solid rgba(255,255,255,.3);
-            border-radius: 50%;
-            border-top-color: #fff;
-            animation: spin 1s ease-in-out infinite;
-        }
-
-        @keyframes spin {
-            to { transform: rotate(360deg); }
-        }
-
-        /* Auto Collect Section */
-        .auto-collect {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            color: white;
-            text-align: center;
-        }
-
-        .auto-collect .card-title {
-            color: white;
-        }
-
-        .auto-collect .btn {
-            background: rgba(255,255,255,0.2);
-            color: white;
-            border: 1px solid rgba(255,255,255,0.3);
-        }
-
-        .auto-collect .btn:hover {
-            background: rgba(255,255,255,0.3);
-        }
-
-        /* Footer */
-        footer {
-            text-align: center;
-            margin-top: 40px;
-            padding: 20px;
-            color: var(--text-light);
-            font-size: 0.875rem;
-        }
-
-        .empty-state {
-            text-align: center;
-            padding: 40px 20px;
-            color: var(--text-light);
-        }
-
-        .empty-state i {
-            font-size: 3rem;
-            margin-bottom: 16px;
-            opacity: 0.5;
-        }
-    </style>
-</head>
-<body>
-    <header>
-        <div class="container">
-            <div class="header-content">
-                <div class="logo">
-                    <i class="fab fa-github"></i>
-                    <span>GitHub Analytics</span>
-                </div>
-                <div class="user-info">
-                    <i class="fas fa-user-circle"></i>
-                    <span>Dashboard</span>
-                </div>
-            </div>
-        </div>
-    </header>
-
-    <main class="container">
-        <div class="dashboard">
-            <div class="main-content">
-                <!-- Token Section -->
-                <div class="card">
-                    <div class="card-header">
-                        <i class="fas fa-key"></i>
-                        <h2 class="card-title">GitHub Token</h2>
-                    </div>
-                    <p style="margin-bottom: 16px; color: var(--text-light);">
-                        Для работы приложения требуется Personal Access Token. 
-                        <a href="https://github.com/settings/tokens" target="_blank" style="color: var(--secondary);">Создать токен</a>
-                    </p>
-                    <form action="/token" method="post" id="tokenForm">
-                        <div class="form-group">
-                            <label class="form-label">GitHub Token</label>
-                            <input type="password" name="token" class="form-input" placeholder="ghp_ваш_токен" required>
-                        </div>
-                        <button type="submit" class="btn btn-primary btn-block" id="tokenBtn">
-                            <i class="fas fa-save"></i> Сохранить токен
-                        </button>
-                    </form>
-                </div>
-
-                <!-- Add Repository -->
-                <div class="card">
-                    <div class="card-header">
-                        <i class="fas fa-plus-circle"></i>
-                        <h2 class="card-title">Добавить репозиторий</h2>
-                    </div>
-                    <form action="/track" method="post" id="trackForm">
-                        <div class="form-row">
-                            <div class="form-group">
-                                <label class="form-label">Владелец</label>
-                                <input type="text" name="owner" class="form-input" placeholder="например, microsoft" required>
-                            </div>
-                            <div class="form-group">
-                                <label class="form-label">Репозиторий</label>
-                                <input type="text" name="repo" class="form-input" placeholder="например, vscode" required>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-primary btn-block" id="trackBtn">
-                            <i class="fas fa-plus"></i> Добавить для отслеживания
-                        </button>
-                    </form>
-                </div>
-
-                <!-- Tracked Repositories Widgets -->
-                <div class="card">
-                    <div class="card-header">
-                        <i class="fas fa-chart-line"></i>
-                        <h2 class="card-title">Мои репозитории</h2>
-                    </div>
-                    <div id="repoWidgets" class="repo-widgets">
-                        <div class="empty-state">
-                            <i class="fas fa-chart-bar"></i>
-                            <h3>Нет отслеживаемых репозиториев</h3>
-                            <p>Добавьте репозитории выше, чтобы видеть их статистику здесь</p>
-                        </div>
-                    </div>
-                </div>
-
-                <!-- Quick Stats -->
-                <div class="card">
-                    <div class="card-header">
-                        <i class="fas fa-bolt"></i>
-                        <h2 class="card-title">Быстрый сбор статистики</h2>
-                    </div>
-                    <form id="statsForm">
-                        <div class="form-row">
-                            <div class="form-group">
-                                <label class="form-label">Владелец</label>
-                                <input type="text" id="quickOwner" class="form-input" placeholder="владелец репозитория" required>
-                            </div>
-                            <div class="form-group">
-                                <label class="form-label">Репозиторий</label>
-                                <input type="text" id="quickRepo" class="form-input" placeholder="название репозитория" required>
-                            </div>
-                        </div>
-                        <button type="submit" class="btn btn-secondary btn-block" id="statsBtn">
-                            <i class="fas fa-chart-bar"></i> Собрать статистику
-                        </button>
-                    </form>
-                </div>
-
-                <!-- Results -->
-                <div id="result"></div>
-            </div>
-
-            <div class="sidebar">
-                <!-- Auto Collect -->
-                <div class="card auto-collect">
-                    <div class="card-header">
-                        <i class="fas fa-robot"></i>
-                        <h2 class="card-title">Авто-сбор данных</h2>
-                    </div>
-                    <p style="margin-bottom: 16px; opacity: 0.9;">
-                        Соберите статистику по всем отслеживаемым репозиториям одним кликом
-                    </p>
-                    <button onclick="runAutoCollect()" class="btn btn-block" id="autoCollectBtn">
-                        <i class="fas fa-play"></i> Запустить авто-сбор
-                    </button>
-                </div>
-
-                <!-- Info -->
-                <div class="card">
-                    <div class="card-header">
-                        <i class="fas fa-info-circle"></i>
-                        <h2 class="card-title">Информация</h2>
-                    </div>
-                    <div style="font-size: 0.875rem; color: var(--text-light);">
-                        <p>📊 Собираемая статистика:</p>
-                        <ul style="margin: 8px 0 8px 16px;">
-                            <li>Звезды ⭐</li>
-                            <li>Просмотры 👀</li>
-                            <li>Клоны 💾</li>
-                            <li>Форки 🍴</li>
-                        </ul>
-                        <p>Данные сохраняются навсегда</p>
-                    </div>
-                </div>
-            </div>
-        </div>
-    </main>
-
-    <footer>
-        <div class="container">
-            <p>GitHub Analytics Dashboard &copy; 2023 | Отслеживайте статистику ваших репозиториев</p>
-        </div>
-    </footer>
-
-    <script>
-        // Загрузить виджеты репозиториев
-        async function loadRepoWidgets() {
-            const repoWidgets = document.getElementById('repoWidgets');
-            
-            try {
-                const response = await fetch('/tracked');
-                const data = await response.json();
-                
-                if (data.repos && data.repos.length > 0) {
-                    repoWidgets.innerHTML = data.repos.map(repo => `
-                        <div class="repo-widget loading" id="widget-${repo.owner}-${repo.name}">
-                            <div class="repo-widget-header">
-                                <div class="repo-widget-info">
-                                    <div class="repo-widget-name">${repo.name}</div>
-                                    <div class="repo-widget-owner">${repo.owner}</div>
-                                </div>
-                                <div class="repo-widget-actions">
-                                    <button class="refresh-btn" onclick="refreshRepo('${repo.owner}', '${repo.name}')" title="Обновить">
-                                        <i class="fas fa-sync-alt"></i>
-                                    </button>
-                                </div>
-                            </div>
-                            <div class="repo-widget-stats">
-                                <div class="repo-stat">
-                                    <div class="repo-stat-value">-</div>
-                                    <div class="repo-stat-label"><i class="fas fa-star"></i> Stars</div>
-                                </div>
-                                <div class="repo-stat">
-                                    <div class="repo-stat-value">-</div>
-                                    <div class="repo-stat-label"><i class="fas fa-eye"></i> Views</div>
-                                </div>
-                                <div class="repo-stat">
-                                    <div class="repo-stat-value">-</div>
-                                    <div class="repo-stat-label"><i class="fas fa-download"></i> Clones</div>
-                                </div>
-                            </div>
-                            <div class="repo-widget-updated">
-                                <i class="fas fa-clock"></i> Загрузка...
-                            </div>
-                        </div>
-                    `).join('');
-
-                    // Загружаем статистику для каждого репозитория
-                    data.repos.forEach(repo => {
-                        loadRepoStats(repo.owner, repo.name);
-                    });
-                } else {
-                    repoWidgets.innerHTML = `
-                        <div class="empty-state">
-                            <i class="fas fa-chart-bar"></i>
-                            <h3>Нет отслеживаемых репозиториев</h3>
-                            <p>Добавьте репозитории выше, чтобы видеть их статистику здесь</p>
-                        </div>
-                    `;
-                }
-            } catch (error) {
-                repoWidgets.innerHTML = '<div class="message message-error">Ошибка загрузки репозиториев</div>';
-            }
-        }
-
-        // Загрузить статистику для конкретного репозитория
-        async function loadRepoStats(owner, repo) {
-            const widget = document.getElementById(`widget-${owner}-${repo}`);
-            if (!widget) return;
-
-            try {
-                const response = await fetch(`/stats/${owner}/${repo}`, {
-                    method: 'POST',
-                    credentials: 'include'
-                });
-                
-                if (response.ok) {
-                    const data = await response.json();
-                    
-                    widget.classList.remove('loading');
-                    widget.innerHTML = `
-                        <div class="repo-widget-header">
-                            <div class="repo-widget-info">
-                                <div class="repo-widget-name">${repo}</div>
-                                <div class="repo-widget-owner">${owner}</div>
-                            </div>
-                            <div class="repo-widget-actions">
-                                <button class="refresh-btn" onclick="refreshRepo('${owner}', '${repo}')" title="Обновить">
-                                    <i class="fas fa-sync-alt"></i>
-                                </button>
-                            </div>
-                        </div>
-                        <div class="repo-widget-stats">
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.stars}</div>
-                                <div class="repo-stat-label"><i class="fas fa-star"></i> Stars</div>
-                            </div>
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.views}</div>
-                                <div class="repo-stat-label"><i class="fas fa-eye"></i> Views</div>
-                            </div>
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.clones}</div>
-                                <div class="repo-stat-label"><i class="fas fa-download"></i> Clones</div>
-                            </div>
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.unique_visitors}</div>
-                                <div class="repo-stat-label"><i class="fas fa-users"></i> Unique</div>
-                            </div>
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.unique_clones}</div>
-                                <div class="repo-stat-label"><i class="fas fa-user-check"></i> Unique Clones</div>
-                            </div>
-                            <div class="repo-stat">
-                                <div class="repo-stat-value">${data.data.forks}</div>
-                                <div class="repo-stat-label"><i class="fas fa-code-branch"></i> Forks</div>
-                            </div>
-                        </div>
-                        <div class="repo-widget-updated">
-                            <i class="fas fa-clock"></i> Обновлено: ${new Date().toLocaleTimeString()}
-                        </div>
-                    `;
-                } else {
-                    widget.classList.remove('loading');
-                    widget.innerHTML = `
-                        <div class="repo-widget-header">
-                            <div class="repo-widget-info">
-                                <div class="repo-widget-name">${repo}</div>
-                                <div class="repo-widget-owner">${owner}</div>
-                            </div>
-                        </div>
-                        <div style="text-align: center; color: var(--danger); padding: 20px;">
-                            <i class="fas fa-exclamation-triangle"></i>
-                            <div>Ошибка загрузки</div>
-                        </div>
-                    `;
-                }
-            } catch (error) {
-                widget.classList.remove('loading');
-                widget.innerHTML = `
-                    <div class="repo-widget-header">
-                        <div class="repo-widget-info">
-                            <div class="repo-widget-name">${repo}</div>
-                            <div class="repo-widget-owner">${owner}</div>
-                        </div>
-                    </div>
-                    <div style="text-align: center; color: var(--danger); padding: 20px;">
-                        <i class="fas fa-exclamation-triangle"></i>
-                        <div>Ошибка соединения</div>
-                    </div>
-                `;
-            }
-        }
+    def _put(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Отставшему клиенту вместо выборочной потери событий — команда перечитать дашборд
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync"})
+
+    def publish_snapshots(self, results):
+        """Записанные снимки (owner, repo, stats или None) — только сессиям, которые видят их в /dashboard"""
+        if not self._subscribers:
+            return
+        # Результат без трафика не рассылаем: виджеты подписчиков с push показали бы прочерки
+        snapshots = {(owner, repo): stats for owner, repo, stats in results if stats is not None and has_traffic(stats)}
+        if not snapshots:
+            return
+        collected_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        for session_id, repos in get_session_push_repos(list(self._subscribers)).items():
+            for owner, repo in repos & snapshots.keys():
+                stats = {key: snapshots[owner, repo][key] for key in SNAPSHOT_FIELDS}
+                event = {"type": "snapshot", "owner": owner, "repo": repo,
+                         "stats": {**stats, "collected_at": collected_at}}
+                for queue in self._subscribers.get(session_id, ()):
+                    self._put(queue, event)
+
+    def publish_progress(self, progress):
+        """Прогресс прогона всем подписчикам не чаще progress_interval; завершение — сразу"""
+        self._progress = dict(progress)
+        if progress["finished_at"] is not None:
+            if self._progress_handle is not None:
+                self._progress_handle.cancel()
+            self._send_progress()
+        elif self._progress_handle is None and self._subscribers:
+            self._progress_handle = asyncio.get_running_loop().call_later(self.progress_interval, self._send_progress)
+
+    def _send_progress(self):
+        self._progress_handle = None
+        event = {"type": "progress", **self._progress}
+        for queues in self._subscribers.values():
+            for queue in queues:
+                self._put(queue, event)
+
+broker = EventBroker()
 
-        // Обновить статистику репозитория
-        async function refreshRepo(owner, repo) {
-            const widget = document.getElementById(`widget-${owner}-${repo}`);
-            if (widget) {
-                widget.classList.add('loading');
-                await loadRepoStats(owner, repo);
-            }
-        }
+# ==================== АВТО-СБОР ====================
+class StatsWriteBuffer:
+    """Write-behind буфер результатов сбора, доступов токенов и кеша ETag: сброс одной транзакцией
+    по числу результатов или по таймеру"""
+
+    # STATS_FLUSH_INTERVAL — компромисс задержки и надежности: при падении теряется не больше
+    # интервала результатов, но и их расписание не сдвинуто, так что планировщик соберет их снова.
+    # 0 — каждый результат пишется сразу.
+
+    def __init__(self, interval=STATS_FLUSH_INTERVAL, batch_size=STATS_FLUSH_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending = []
+        self._access = {}
+        self._responses = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, owner, repo, stats, scheduled=True):
+        """Результат сбора; scheduled=False — интерактивное обновление, ошибка которого не двигает расписание"""
+        self._pending.append((owner, repo, stats, scheduled))
+        if self.interval <= 0 or len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def record_access(self, owner, repo, token, can_push, can_read=True):
+        self._access[(token_hash(token), owner, repo)] = (int(can_read), int(can_push))
+
+    def cache_response(self, url, token, etag, last_modified, body):
+        self._responses[(url, token_hash(token))] = (etag, last_modified, body)
+
+    def cached_response(self, url, token):
+        """Ответ, еще не записанный в http_cache: (etag, last_modified, body) или None"""
+        return self._responses.get((url, token_hash(token)))
+
+    def flush(self):
+        batch, self._pending = self._pending, []
+        access, self._access = self._access, {}
+        responses, self._responses = self._responses, {}
+        if batch or access or responses:
+            try:
+                save_collected_batch(batch, [(*key, *value) for key, value in access.items()],
+                                     [(*key, *value) for key, value in responses.items()])
+            except Exception:
+                # Неудачная запись (например, БД занята дольше busy_timeout) не теряет пачку:
+                # она вернется в буфер перед более новыми данными и уйдет при следующем сбросе
+                self._pending[:0] = batch
+                self._access = {**access, **self._access}
+                self._responses = {**responses, **self._responses}
+                raise
+            broker.publish_snapshots([(owner, repo, stats) for owner, repo, stats, _ in batch])
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ Запись снимков: {e}")
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+
+write_buffer = StatsWriteBuffer()
+
+class CollectionEngine:
+    """Параллельный сбор статистики с общим лимитом и лимитом на токен"""
+
+    def __init__(self, concurrency=COLLECT_CONCURRENCY, per_token=COLLECT_TOKEN_CONCURRENCY,
+                 timeout=COLLECT_REPO_TIMEOUT):
+        self.concurrency = concurrency
+        self.per_token = per_token
+        self.timeout = timeout
+        self._global_limit = None
+        self._token_limits = {}
+        self.progress = None
+        self.profile_next = False
+
+    def _token_limit(self, token):
+        if token not in self._token_limits:
+            self._token_limits[token] = asyncio.Semaphore(self.per_token)
+        return self._token_limits[token]
+
+    async def _collect_one(self, owner, repo, token, progress, metadata=None):
+        # Сначала слот токена, потом общий: ожидающие занятого токена не держат общие слоты
+        async with self._token_limit(token), self._global_limit:
+            try:
+                stats = await asyncio.wait_for(get_github_stats(owner, repo, token, metadata), self.timeout)
+            except asyncio.TimeoutError:
+                stats = {"success": False, "error": f"таймаут {self.timeout} с"}
+            except Exception as e:
+                stats = {"success": False, "error": str(e)}
+            write_buffer.add(owner, repo, stats["data"] if stats["success"] else None)
+
+        progress["done"] += 1
+        broker.publish_progress(progress)
+        COLLECT_RESULTS.inc("success" if stats["success"] else "failure")
+        if stats["success"]:
+            progress["succeeded"] += 1
+            print(f"✅ {owner}/{repo}")
+        else:
+            progress["failed"] += 1
+            print(f"❌ {owner}/{repo}: {stats['error']}")
+        return stats
+
+    async def _collect_batch(self, metadata_token, jobs, progress):
+        """Метаданные пачки одним GraphQL-запросом, затем трафик по каждому репозиторию своим токеном"""
+        async with self._token_limit(metadata_token), self._global_limit:
+            try:
+                repos = [(owner, repo) for owner, repo, _ in jobs]
+                metadata = await asyncio.wait_for(fetch_repo_metadata_batch(repos, metadata_token), self.timeout)
+            except Exception as e:
+                print(f"⚠️ GraphQL: {e}, звезды и форки через REST")
+                metadata = {}
+
+        await asyncio.gather(*(
+            self._collect_one(owner, repo, traffic_token, progress, metadata.get((owner, repo)))
+            for owner, repo, traffic_token in jobs
+        ))
+
+    async def run(self, jobs):
+        """Собирает статистику для списка (owner, repo, токен трафика, токен метаданных), возвращает итог прогона"""
+        profile = PROFILE_COLLECT or self.profile_next
+        self.profile_next = False
+        with profiling(f"collect-{len(jobs)}") if profile else nullcontext():
+            return await self._run(jobs)
+
+    async def _run(self, jobs):
+        if self._global_limit is None:
+            self._global_limit = asyncio.Semaphore(self.concurrency)
+
+        progress = {
+            "total": len(jobs),
+            "done": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "started_at": datetime.now().isoformat(),
+            "finished_at": None,
+        }
+        self.progress = progress
+        broker.publish_progress(progress)
+        started = time.monotonic()
+
+        by_token = {}
+        for owner, repo, traffic_token, metadata_token in jobs:
+            by_token.setdefault(metadata_token, []).append((owner, repo, traffic_token))
+        await asyncio.gather(*(
+            self._collect_batch(token, batch[i:i + GRAPHQL_BATCH_SIZE], progress)
+            for token, batch in by_token.items()
+            for i in range(0, len(batch), GRAPHQL_BATCH_SIZE)
+        ))
+        # Расписание должно быть записано до того, как планировщик выберет следующую пачку
+        write_buffer.flush()
+        progress["finished_at"] = datetime.now().isoformat()
+        COLLECT_RUN_SECONDS.set(round(time.monotonic() - started, 3))
+        broker.publish_progress(progress)
+        return progress
+
+collector = CollectionEngine()
+
+class TokenPool:
+    """Распределяет сбор по токенам подписчиков: один сбор на репозиторий, токен с доступом и наибольшим запасом"""
+
+    def __init__(self):
+        self._headroom = {}
+
+    def _remaining(self, token, resource):
+        key = (token, resource)
+        if key not in self._headroom:
+            self._headroom[key] = governor.remaining(token, resource)
+        return self._headroom[key]
+
+    def _spend(self, token, resource, cost):
+        self._headroom[(token, resource)] = self._remaining(token, resource) - cost
+
+    def plan(self, due_repos):
+        """Возвращает задания (owner, repo, токен трафика, токен метаданных) и репозитории без доступных токенов"""
+        # Остаток уменьшается с каждым назначением, поэтому большая пачка расходится по всем токенам,
+        # а не достается целиком одному
+        self._headroom = {}
+        jobs, denied = [], []
+        for (owner, repo), candidates in due_repos.items():
+            readable = [c for c in candidates if c[1] != 0]
+            if not readable:
+                # Все токены недавно получили 403/404 — не тратим на них запросы до истечения TOKEN_ACCESS_TTL
+                denied.append((owner, repo))
+                continue
+
+            # Трафику нужен push: сначала подтвержденный, затем непроверенный доступ
+            pushable = [c for c in readable if c[2] != 0] or readable
+            traffic_token = max(pushable, key=lambda c: (c[2] == 1, self._remaining(c[0], "core")))[0]
+            self._spend(traffic_token, "core", 2)
+
+            # Звезды и форки может прочитать любой токен с доступом на чтение
+            metadata_token = max(readable, key=lambda c: self._remaining(c[0], "graphql"))[0]
+            self._spend(metadata_token, "graphql", 1 / GRAPHQL_BATCH_SIZE)
+
+            jobs.append((owner, repo, traffic_token, metadata_token))
+        return jobs, denied
+
+token_pool = TokenPool()
+
+class CollectionScheduler:
+    """Фоновый планировщик: отдает движку репозитории с наступившим next_due_at"""
+
+    def __init__(self, engine, tick=SCHEDULER_TICK):
+        self.engine = engine
+        self.tick = tick
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def run_due(self):
+        jobs, denied = token_pool.plan(get_due_repos())
+        for owner, repo in denied:
+            print(f"⛔ {owner}/{repo}: ни у одного токена нет доступа")
+            write_buffer.add(owner, repo, None)
+        write_buffer.flush()
+        if jobs:
+            print(f"🤖 Авто-сбор: {len(jobs)} репозиториев")
+            await self.engine.run(jobs)
+        return len(jobs) + len(denied)
+
+    async def _loop(self):
+        while True:
+            try:
+                # Пока есть просроченные репозитории, собираем их без паузы
+                if await self.run_due() >= SCHEDULER_BATCH:
+                    continue
+            except Exception as e:
+                print(f"❌ Планировщик: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+scheduler = CollectionScheduler(collector)
+
+@db_timed
+def auto_collect():
+    """Ставит все отслеживаемые репозитории в очередь на немедленный сбор"""
+    conn = get_db()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('UPDATE tracked_repos SET next_due_at = ?', (datetime.now().isoformat(timespec='seconds'),))
+        queued = cursor.rowcount
+    
+    scheduler.wake()
+    return queued
+
+# ==================== КЕШ СТАТИСТИКИ ====================
+_refreshes = {}
+
+async def _refresh(owner, repo, token):
+    stats = await get_github_stats(owner, repo, token)
+    # Ошибка одного пользователя (чужой токен, 404) не двигает общее расписание сбора —
+    # иначе частые запросы /stats держали бы репозиторий вне планировщика
+    if stats["success"]:
+        write_buffer.add(owner, repo, stats["data"], scheduled=False)
+    # Снимок, доступ токена и кеш ETag пишутся сразу одной транзакцией: их видит следующий /stats и /dashboard
+    write_buffer.flush()
+    return stats
+
+def refresh_stats(owner, repo, token, background=False):
+    """Обновление из GitHub с объединением одновременных запросов в один"""
+    # Фоновое обновление общее для репозитория, синхронное — для пары репозиторий/токен,
+    # чтобы без подтвержденного доступа никто не получил чужой результат
+    key = (owner, repo) if background else (owner, repo, token_hash(token))
+    task = _refreshes.get(key)
+    if task is None:
+        task = asyncio.create_task(_refresh(owner, repo, token))
+        _refreshes[key] = task
+        task.add_done_callback(lambda _: _refreshes.pop(key, None))
+    return task
+
+async def get_stats_cached(owner, repo, token, force=False):
+    """Read-through кеш: свежий снимок из БД, устаревший — с фоновым обновлением"""
+    access = None if force else get_repo_access(owner, repo, token)
+    if access and access[0]:
+        cached = get_latest_stats(owner, repo)
+        if cached:
+            age = cached.pop('age')
+            if age > STATS_TTL:
+                refresh_stats(owner, repo, token, background=True)
+            if not access[1]:
+                # Токену без push отдаем из общего снимка только звезды и форки
+                cached.update(dict.fromkeys(TRAFFIC_FIELDS))
+            return {"success": True, "data": cached, "cached": True, "stale": age > STATS_TTL}
+
+    stats = await asyncio.shield(refresh_stats(owner, repo, token))
+    return {**stats, "cached": False, "stale": False}
+
+# ==================== ИСТОРИЯ ЗВЕЗД ====================
+STARGAZERS_QUERY = '''
+query($owner: String!, $name: String!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    stargazers(first: 100, after: $cursor, orderBy: {field: STARRED_AT, direction: ASC}) {
+      pageInfo { hasNextPage endCursor }
+      edges { starredAt }
+    }
+  }
+}
+'''
+
+_backfills = {}
+
+async def backfill_stargazers(owner, repo, token):
+    """Постранично выкачивает starredAt и сворачивает в дневные приросты; в памяти только одна страница"""
+    state = get_backfill_state(owner, repo)
+    cursor = state['cursor'] if state else None
+    print(f"⭐ Бэкфилл звезд {owner}/{repo} {'с курсора ' + cursor if cursor else 'с начала'}")
 
-        // Сбор статистики
-        document.getElementById('statsForm').addEventListener('submit', async (e) => {
-            e.preventDefault();
-            const owner = document.getElementById('quickOwner').value;
-            const repo = document.getElementById('quickRepo').value;
-            const statsBtn = document.getElementById('statsBtn');
-            const originalText = statsBtn.innerHTML;
-            
-            // Показать загрузку
-            statsBtn.innerHTML = '<div class="loading"></div> Загрузка...';
-            statsBtn.disabled = true;
-            
-            try {
-                const response = await fetch(`/stats/${owner}/${repo}`, {
-                    method: 'POST',
-                    credentials: 'include'
-                });
-                
-                const data = await response.json();
-                
-                if (response.ok) {
-                    document.getElementById('result').innerHTML = `
-                        <div class="card">
-                            <div class="card-header">
-                                <i class="fas fa-check-circle" style="color: var(--success);"></i>
-                                <h2 class="card-title">Статистика для ${owner}/${repo}</h2>
-                            </div>
-                            <div class="stats-grid">
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-star"></i> Звезды</div>
-                                    <div class="stat-value">${data.data.stars}</div>
-                                </div>
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-eye"></i> Просмотры</div>
-                                    <div class="stat-value">${data.data.views}</div>
-                                </div>
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-download"></i> Клоны</div>
-                                    <div class="stat-value">${data.data.clones}</div>
-                                </div>
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-code-branch"></i> Форки</div>
-                                    <div class="stat-value">${data.data.forks}</div>
-                                </div>
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-users"></i> Уникальные посетители</div>
-                                    <div class="stat-value">${data.data.unique_visitors}</div>
-                                </div>
-                                <div class="stat-card">
-                                    <div class="stat-label"><i class="fas fa-user-check"></i> Уникальные клоны</div>
-                                    <div class="stat-value">${data.data.unique_clones}</div>
-                                </div>
-                            </div>
-                            <div style="margin-top: 16px; font-size: 0.875rem; color: var(--text-light);">
-                                <i class="fas fa-clock"></i> Данные собраны: ${new Date(data.data.collected_at).toLocaleString()}
-                            </div>
-                        </div>
-                    `;
-                    loadRepoWidgets(); // Обновить виджеты
-                } else {
-                    document.getElementById('result').innerHTML = `
-                        <div class="message message-error">
-                            <i class="fas fa-exclamation-triangle"></i>
-                            <div>${data.detail || 'Произошла ошибка'}</div>
-                        </div>
-                    `;
-                }
-            } catch (error) {
-                document.getElementById('result').innerHTML = `
-                    <div class="message message-error">
-                        <i class="fas fa-exclamation-triangle"></i>
-                        <div>Ошибка соединения: ${error.message}</div>
-                    </div>
-                `;
-            } finally {
-                // Восстановить кнопку
-                statsBtn.innerHTML = originalText;
-                statsBtn.disabled = false;
-            }
-        });
-
-        // Авто-сбор
-        async function runAutoCollect() {
-            const autoCollectBtn = document.getElementById('autoCollectBtn');
-            const originalText = autoCollectBtn.innerHTML;
-            
-            autoCollectBtn.innerHTML = '<div class="loading"></div> Сбор данных...';
-            autoCollectBtn.disabled = true;
-            
-            try {
-                const response = await fetch('/auto-collect', {
-                    method: 'POST',
-                    credentials: 'include'
-                });
-                const data = await response.json();
-                
-                alert(data.message);
-                loadRepoWidgets(); // Обновить виджеты после сбора
-            } catch (error) {
-                alert('Ошибка при авто-сборе: ' + error.message);
-            } finally {
-                autoCollectBtn.innerHTML = originalText;
-                autoCollectBtn.disabled = false;
-            }
-        }
+    try:
+        while True:
+            try:
+                result = await github.graphql(STARGAZERS_QUERY, {"owner": owner, "name": repo, "cursor": cursor}, token)
+            except RateLimitExhausted as e:
+                # Ждем столько, сколько насчитал бюджет: конец вторичного лимита, а не обязательно
+                # сброс окна GraphQL, — и продолжаем с того же курсора
+                await asyncio.sleep(max(e.retry_after, 1.0))
+                continue
+
+            repository = (result.get('data') or {}).get('repository')
+            if repository is None:
+                raise RuntimeError(result.get('errors', [{}])[0].get('message', 'репозиторий недоступен'))
+
+            stargazers = repository['stargazers']
+            days = {}
+            for edge in stargazers['edges']:
+                day = edge['starredAt'][:10]
+                days[day] = days.get(day, 0) + 1
+            if stargazers['edges']:
+                cursor = stargazers['pageInfo']['endCursor']
+                save_stargazer_page(owner, repo, days, cursor, len(stargazers['edges']))
+
+            if not stargazers['pageInfo']['hasNextPage']:
+                break
+
+        set_backfill_status(owner, repo, 'done')
+        print(f"⭐ Бэкфилл звезд {owner}/{repo} завершен")
+    except asyncio.CancelledError:
+        # Остановка сервера: статус остается running, при старте продолжим
+        raise
+    except Exception as e:
+        set_backfill_status(owner, repo, 'failed', str(e))
+        print(f"❌ Бэкфилл звезд {owner}/{repo}: {e}")
+
+def start_backfill(owner, repo, token):
+    """Запускает бэкфилл, если он еще не идет"""
+    task = _backfills.get((owner, repo))
+    if task is None or task.done():
+        set_backfill_status(owner, repo, 'running')
+        task = asyncio.create_task(backfill_stargazers(owner, repo, token))
+        _backfills[(owner, repo)] = task
+    return task
+
+async def stop_backfills():
+    for task in _backfills.values():
+        task.cancel()
+    await asyncio.gather(*_backfills.values(), return_exceptions=True)
+    _backfills.clear()
 
-        // Добавить обработчики для форм
-        document.getElementById('tokenForm').addEventListener('submit', function() {
-            const btn = document.getElementById('tokenBtn');
-            btn.innerHTML = '<div class="loading"></div> Сохранение...';
-        });
-
-        document.getElementById('trackForm').addEventListener('submit', function() {
-            const btn = document.getElementById('trackBtn');
-            btn.innerHTML = '<div class="loading"></div> Добавление...';
-            // После добавления репозитория обновляем виджеты
-            setTimeout(loadRepoWidgets, 1000);
-        });
-
-        // Загрузить виджеты при загрузке страницы
-        document.addEventListener('DOMContentLoaded', loadRepoWidgets);
-
-        // Авто-обновление каждые 5 минут
-        setInterval(loadRepoWidgets, 5 * 60 * 1000);
-    </script>
-</body>
-</html>
-"""
+# ==================== ВЕБ-ИНТЕРФЕЙС ====================
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_MAX_AGE = 365 * 24 * 3600
+STATIC_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".svg": "image/svg+xml",
+}
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def choose_encoding(accept_encoding, available):
+    """Лучшее из заранее сжатых представлений, которое принимает клиент"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            accepted[name.strip().lower()] = float(q) if q else 1.0
+        except ValueError:
+            continue
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+class StaticAsset:
+    """Файл интерфейса в памяти: исходник и сжатые при старте варианты, у каждого свой строгий ETag"""
+
+    def __init__(self, body, media_type):
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body, "gzip": gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+
+    def response(self, request, cache_control):
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""), self.variants)
+        etag = f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.variants[encoding], media_type=self.media_type, headers=headers)
+
+def load_static():
+    """Ассеты из static/ под именами с хешем содержимого; index.html ссылается на них через {{имя}}"""
+    assets, urls = {}, {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        stem, ext = os.path.splitext(name)
+        if name == "index.html" or ext not in STATIC_TYPES:
+            continue
+        with open(os.path.join(STATIC_DIR, name), "rb") as f:
+            asset = StaticAsset(f.read(), STATIC_TYPES[ext])
+        hashed = f"{stem}.{asset.digest[:12]}{ext}"
+        assets[hashed] = asset
+        urls[name] = f"/static/{hashed}"
+
+    with open(os.path.join(STATIC_DIR, "index.html"), encoding="utf-8") as f:
+        page = f.read()
+    for name, url in urls.items():
+        page = page.replace("{{" + name + "}}", url)
+    return StaticAsset(page.encode(), STATIC_TYPES[".html"]), assets
+
+index_page, static_assets = load_static()
 
 # ==================== API ====================
+@asynccontextmanager
+async def lifespan(app):
+    await github.start()
+    loop_monitor.start()
+    write_buffer.start()
+    scheduler.start()
+    for owner, repo, token in get_running_backfills():
+        if token:
+            start_backfill(owner, repo, token)
+        else:
+            # Иначе бэкфилл без токена навсегда остался бы running
+            set_backfill_status(owner, repo, 'failed', 'нет токена, чтобы продолжить после перезапуска')
+    yield
+    await stop_backfills()
+    await scheduler.stop()
+    await write_buffer.stop()
+    await loop_monitor.stop()
+    await github.close()
+    close_db()
+
+app = FastAPI(title="GitHub Analytics", lifespan=lifespan, default_response_class=ProfiledJSONResponse)
+
+if PROFILE_TOKEN:
+    @app.middleware("http")
+    async def profile_requests(request: Request, call_next):
+        if not is_profile_request(request):
+            return await call_next(request)
+        with profiling(f"{request.method} {request.url.path}") as name:
+            response = await call_next(request)
+        response.headers["X-Profile"] = name
+        return response
+
 @app.get("/")
-async def root():
-    return HTMLResponse(HTML)
+async def root(request: Request):
+    # Сама страница всегда перепроверяется (304 без тела), ассеты по хешу кешируются навсегда
+    return index_page.response(request, "no-cache")
+
+@app.get("/static/{name}")
+async def static_file(name: str, request: Request):
+    asset = static_assets.get(name)
+    if asset is None:
+        raise HTTPException(404, "Файл не найден")
+    return asset.response(request, f"public, max-age={STATIC_MAX_AGE}, immutable")
 
 @app.post("/token")
 async def set_token(request: Request, token: str = Form(...)):
@@ -1044,26 +2224,24 @@ async def track_repo(request: Request, owner: str = Form(...), repo: str = Form(
     
     token = get_token(session_id)
     if token:
-        stats = get_github_stats(owner, repo, token)
-        if stats["success"]:
-            save_stats(owner, repo, stats["data"])
+        # Свежий снимок, собранный по другой подписке, повторно не запрашиваем
+        await get_stats_cached(owner, repo, token)
     
     return HTMLResponse(f"✅ {owner}/{repo} добавлен! <a href='/'>Назад</a>")
 
 @app.post("/stats/{owner}/{repo}")
-async def collect_stats(owner: str, repo: str, request: Request):
+async def collect_stats(owner: str, repo: str, request: Request, force: bool = False):
     session_id = request.cookies.get("session_id")
     token = get_token(session_id) if session_id else None
     
     if not token:
         raise HTTPException(400, "Сначала сохраните токен")
     
-    stats = get_github_stats(owner, repo, token)
+    stats = await get_stats_cached(owner, repo, token, force=force)
     if not stats["success"]:
         raise HTTPException(400, stats["error"])
     
-    save_stats(owner, repo, stats["data"])
-    return {"message": "Статистика собрана!", "data": stats["data"]}
+    return {"message": "Статистика собрана!", "data": stats["data"], "cached": stats["cached"], "stale": stats["stale"]}
 
 @app.get("/tracked")
 async def get_tracked(request: Request):
@@ -1071,11 +2249,179 @@ async def get_tracked(request: Request):
     repos = get_tracked_repos(session_id) if session_id else []
     return {"repos": repos}
 
+@app.get("/dashboard")
+async def dashboard(request: Request, limit: int = 100, offset: int = 0):
+    session_id = request.cookies.get("session_id")
+    if not session_id:
+        return {"repos": [], "total": 0, "limit": limit, "offset": offset}
+    
+    limit = max(1, min(limit, 500))
+    result = get_dashboard(session_id, get_token(session_id), limit, max(offset, 0))
+    return {**result, "limit": limit, "offset": offset}
+
+@app.get("/events")
+async def events(request: Request):
+    session_id = request.cookies.get("session_id")
+    if not session_id or not get_token(session_id):
+        raise HTTPException(400, "Сначала сохраните токен")
+    
+    queue = broker.subscribe(session_id)
+    
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_PING_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Комментарий держит соединение живым через прокси и выявляет отключившихся
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/history/{owner}/{repo}")
+async def history(owner: str, repo: str, request: Request,
+                  start: str = Query("0001-01-01", alias="from"), end: str = Query("9999-12-31", alias="to"),
+                  resolution: str = "day", metrics: str = ",".join(HISTORY_METRICS)):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    if not has_push_access(owner, repo, token):
+        raise HTTPException(403, "Нет доступа к статистике репозитория")
+    if resolution not in HISTORY_BUCKETS:
+        raise HTTPException(400, f"resolution: одно из {', '.join(HISTORY_BUCKETS)}")
+    
+    metric_list = [m.strip() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in metric_list if m not in HISTORY_METRICS]
+    if unknown or not metric_list:
+        raise HTTPException(400, f"Неизвестные метрики: {', '.join(unknown) or '-'}")
+    try:
+        start = datetime.fromisoformat(start).date().isoformat()
+        end = datetime.fromisoformat(end).date().isoformat()
+    except ValueError:
+        raise HTTPException(400, "from/to в формате YYYY-MM-DD")
+    
+    result = get_history(owner, repo, start, end, resolution, metric_list)
+    return {"owner": owner, "repo": repo, "resolution": resolution, **result}
+
+@app.get("/export")
+async def export(request: Request, format: str = "csv", repos: str = "",
+                 start: str = Query("0001-01-01", alias="from"), end: str = Query("9999-12-31", alias="to"),
+                 compress: bool = Query(False, alias="gzip")):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(400, "format: csv или ndjson")
+    try:
+        start = datetime.fromisoformat(start).date().isoformat()
+        end = datetime.fromisoformat(end).date().isoformat()
+    except ValueError:
+        raise HTTPException(400, "from/to в формате YYYY-MM-DD")
+    repo_list = [r.strip() for r in repos.split(",") if r.strip()]
+    if any(r.count("/") != 1 for r in repo_list):
+        raise HTTPException(400, "repos: список owner/repo через запятую")
+    
+    headers = {"Content-Disposition": f'attachment; filename="github-analytics.{format}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    # Синхронный генератор Starlette читает в пуле потоков — цикл событий не блокируется
+    return StreamingResponse(iter_export(session_id, token, repo_list, start, end, format, compress),
+                             media_type=media_type, headers=headers)
+
+@app.post("/import")
+async def import_snapshots(request: Request, file: UploadFile = File(...), format: str = None):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    try:
+        fmt = import_format(file.filename or "", format)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    
+    # Загрузка уже лежит во временном файле; разбор и запись — в отдельном потоке
+    stream = open_import_stream(file.file, file.filename or "")
+    return await asyncio.to_thread(import_stats, stream, fmt, token, paced=True)
+
 @app.post("/auto-collect")
-async def run_auto_collect():
-    auto_collect()
-    return {"message": "Авто-сбор завершен!"}
+async def run_auto_collect(request: Request):
+    if is_profile_request(request):
+        collector.profile_next = True
+    queued = auto_collect()
+    return {"message": f"Авто-сбор запущен: {queued} в очереди", "queued": queued}
+
+@app.get("/rate-limit")
+async def rate_limit_state(request: Request):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    
+    return {"budgets": governor.state(token)}
+
+@app.post("/backfill/{owner}/{repo}")
+async def run_backfill(owner: str, repo: str, request: Request):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    
+    start_backfill(owner, repo, token)
+    return {"message": "Бэкфилл звезд запущен", "state": get_backfill_state(owner, repo)}
+
+@app.get("/backfill/{owner}/{repo}")
+async def backfill_state(owner: str, repo: str, request: Request):
+    session_id = request.cookies.get("session_id")
+    token = get_token(session_id) if session_id else None
+    
+    if not token:
+        raise HTTPException(400, "Сначала сохраните токен")
+    # Прогресс и текст ошибки выдают данные приватного репозитория — как и /stats, только с доступом на чтение
+    access = get_repo_access(owner, repo, token)
+    if not access or not access[0]:
+        raise HTTPException(403, "Нет доступа к репозиторию")
+    
+    state = get_backfill_state(owner, repo)
+    if not state:
+        raise HTTPException(404, "Бэкфилл не запускался")
+    return {"state": state}
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/auto-collect/status")
+async def auto_collect_status():
+    return {"progress": collector.progress, "storage": storage_counters}
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        started = time.monotonic()
+        rebuild_rollups()
+        print(f"✅ Свертки пересчитаны за {time.monotonic() - started:.1f} с")
+    elif sys.argv[1:2] == ["import"] and len(sys.argv) > 2:
+        for path in sys.argv[2:]:
+            with open(path, 'rb') as f:
+                result = import_stats(open_import_stream(f, path), import_format(path))
+            print(f"✅ {path}: {result['imported']} строк за {result['seconds']} с "
+                  f"({result['rows_per_sec']} строк/с), отклонено {result['rejected']}")
+            for error in result['errors']:
+                print(f"   ⚠️ {error}")
+    else:
+        import uvicorn
+        # Открытые потоки /events иначе задерживали бы остановку сервера
+        uvicorn.run(app, host="0.0.0.0", port=8000, timeout_graceful_shutdown=5)
\ No newline at end of file
@@ -0,0 +1,354 @@
+const DASHBOARD_PAGE_SIZE = 100;
+
+// Разметка виджета с собранной статистикой
+function renderRepoWidget(owner, repo, stats) {
+    return `
+        <div class="repo-widget-header">
+            <div class="repo-widget-info">
+                <div class="repo-widget-name">${repo}</div>
+                <div class="repo-widget-owner">${owner}</div>
+            </div>
+            <div class="repo-widget-actions">
+                <button class="refresh-btn" onclick="refreshRepo('${owner}', '${repo}')" title="Обновить">
+                    <svg class="icon"><use href="#fa-sync-alt"></use></svg>
+                </button>
+            </div>
+        </div>
+        <div class="repo-widget-stats">
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.stars}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-star"></use></svg> Stars</div>
+            </div>
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.views ?? '-'}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-eye"></use></svg> Views</div>
+            </div>
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.clones ?? '-'}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-download"></use></svg> Clones</div>
+            </div>
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.unique_visitors ?? '-'}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-users"></use></svg> Unique</div>
+            </div>
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.unique_clones ?? '-'}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-user-check"></use></svg> Unique Clones</div>
+            </div>
+            <div class="repo-stat">
+                <div class="repo-stat-value">${stats.forks}</div>
+                <div class="repo-stat-label"><svg class="icon"><use href="#fa-code-branch"></use></svg> Forks</div>
+            </div>
+        </div>
+        <div class="repo-widget-updated">
+            <svg class="icon"><use href="#fa-clock"></use></svg> Обновлено: ${new Date(stats.collected_at).toLocaleTimeString()}
+        </div>
+    `;
+}
+
+// Виджет, пока статистика загружается
+function renderRepoPlaceholder(repo) {
+    return `
+        <div class="repo-widget loading" id="widget-${repo.owner}-${repo.name}">
+            <div class="repo-widget-header">
+                <div class="repo-widget-info">
+                    <div class="repo-widget-name">${repo.name}</div>
+                    <div class="repo-widget-owner">${repo.owner}</div>
+                </div>
+                <div class="repo-widget-actions">
+                    <button class="refresh-btn" onclick="refreshRepo('${repo.owner}', '${repo.name}')" title="Обновить">
+                        <svg class="icon"><use href="#fa-sync-alt"></use></svg>
+                    </button>
+                </div>
+            </div>
+            <div class="repo-widget-stats">
+                <div class="repo-stat">
+                    <div class="repo-stat-value">-</div>
+                    <div class="repo-stat-label"><svg class="icon"><use href="#fa-star"></use></svg> Stars</div>
+                </div>
+                <div class="repo-stat">
+                    <div class="repo-stat-value">-</div>
+                    <div class="repo-stat-label"><svg class="icon"><use href="#fa-eye"></use></svg> Views</div>
+                </div>
+                <div class="repo-stat">
+                    <div class="repo-stat-value">-</div>
+                    <div class="repo-stat-label"><svg class="icon"><use href="#fa-download"></use></svg> Clones</div>
+                </div>
+            </div>
+            <div class="repo-widget-updated">
+                <svg class="icon"><use href="#fa-clock"></use></svg> Загрузка...
+            </div>
+        </div>
+    `;
+}
+
+function renderRepoCard(repo) {
+    if (!repo.stats) return renderRepoPlaceholder(repo);
+    return `
+        <div class="repo-widget" id="widget-${repo.owner}-${repo.name}">
+            ${renderRepoWidget(repo.owner, repo.name, repo.stats)}
+        </div>
+    `;
+}
+
+// Загрузить виджеты репозиториев: статистика всех репозиториев постранично одним запросом на страницу
+async function loadRepoWidgets() {
+    const repoWidgets = document.getElementById('repoWidgets');
+
+    try {
+        let offset = 0;
+        let total = 0;
+        let html = '';
+        const missing = [];
+
+        do {
+            const response = await fetch(`/dashboard?limit=${DASHBOARD_PAGE_SIZE}&offset=${offset}`, {
+                credentials: 'include'
+            });
+            const data = await response.json();
+            if (!data.repos.length) break;
+
+            total = data.total;
+            offset += data.repos.length;
+            html += data.repos.map(renderRepoCard).join('');
+            repoWidgets.innerHTML = html;
+            missing.push(...data.repos.filter(repo => !repo.stats));
+        } while (offset < total);
+
+        if (offset === 0) {
+            repoWidgets.innerHTML = `
+                <div class="empty-state">
+                    <svg class="icon"><use href="#fa-chart-bar"></use></svg>
+                    <h3>Нет отслеживаемых репозиториев</h3>
+                    <p>Добавьте репозитории выше, чтобы видеть их статистику здесь</p>
+                </div>
+            `;
+            return;
+        }
+
+        // Отдельно запрашиваем только репозитории, для которых еще нет снимка
+        missing.forEach(repo => {
+            loadRepoStats(repo.owner, repo.name);
+        });
+    } catch (error) {
+        repoWidgets.innerHTML = '<div class="message message-error">Ошибка загрузки репозиториев</div>';
+    }
+}
+
+// Загрузить статистику для конкретного репозитория
+async function loadRepoStats(owner, repo, force = false) {
+    const widget = document.getElementById(`widget-${owner}-${repo}`);
+    if (!widget) return;
+
+    try {
+        const response = await fetch(`/stats/${owner}/${repo}${force ? '?force=true' : ''}`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+
+        if (response.ok) {
+            const data = await response.json();
+
+            widget.classList.remove('loading');
+            widget.innerHTML = renderRepoWidget(owner, repo, data.data);
+        } else {
+            widget.classList.remove('loading');
+            widget.innerHTML = `
+                <div class="repo-widget-header">
+                    <div class="repo-widget-info">
+                        <div class="repo-widget-name">${repo}</div>
+                        <div class="repo-widget-owner">${owner}</div>
+                    </div>
+                </div>
+                <div style="text-align: center; color: var(--danger); padding: 20px;">
+                    <svg class="icon"><use href="#fa-exclamation-triangle"></use></svg>
+                    <div>Ошибка загрузки</div>
+                </div>
+            `;
+        }
+    } catch (error) {
+        widget.classList.remove('loading');
+        widget.innerHTML = `
+            <div class="repo-widget-header">
+                <div class="repo-widget-info">
+                    <div class="repo-widget-name">${repo}</div>
+                    <div class="repo-widget-owner">${owner}</div>
+                </div>
+            </div>
+            <div style="text-align: center; color: var(--danger); padding: 20px;">
+                <svg class="icon"><use href="#fa-exclamation-triangle"></use></svg>
+                <div>Ошибка соединения</div>
+            </div>
+        `;
+    }
+}
+
+// Подставить свежий снимок в уже отрисованный виджет
+function updateRepoWidget(owner, repo, stats) {
+    const widget = document.getElementById(`widget-${owner}-${repo}`);
+    if (!widget) return;
+
+    widget.classList.remove('loading');
+    widget.innerHTML = renderRepoWidget(owner, repo, stats);
+}
+
+// Прогресс авто-сбора из событий сервера
+function updateCollectProgress(progress) {
+    const status = document.getElementById('autoCollectStatus');
+    const autoCollectBtn = document.getElementById('autoCollectBtn');
+    const running = !progress.finished_at;
+
+    status.textContent = running
+        ? `Собрано ${progress.done} из ${progress.total}, ошибок: ${progress.failed}`
+        : `Готово: ${progress.succeeded} из ${progress.total}, ошибок: ${progress.failed}`;
+    autoCollectBtn.disabled = running;
+}
+
+// События сервера вместо периодического опроса; после переподключения дашборд перечитывается
+function connectEvents() {
+    const source = new EventSource('/events');
+    let reconnecting = false;
+
+    source.addEventListener('snapshot', (e) => {
+        const event = JSON.parse(e.data);
+        updateRepoWidget(event.owner, event.repo, event.stats);
+    });
+    source.addEventListener('progress', (e) => updateCollectProgress(JSON.parse(e.data)));
+    source.addEventListener('resync', loadRepoWidgets);
+    source.addEventListener('error', () => { reconnecting = true; });
+    source.addEventListener('open', () => {
+        if (reconnecting) loadRepoWidgets();
+        reconnecting = false;
+    });
+}
+
+// Обновить статистику репозитория
+async function refreshRepo(owner, repo) {
+    const widget = document.getElementById(`widget-${owner}-${repo}`);
+    if (widget) {
+        widget.classList.add('loading');
+        await loadRepoStats(owner, repo, true);
+    }
+}
+
+// Сбор статистики
+document.getElementById('statsForm').addEventListener('submit', async (e) => {
+    e.preventDefault();
+    const owner = document.getElementById('quickOwner').value;
+    const repo = document.getElementById('quickRepo').value;
+    const statsBtn = document.getElementById('statsBtn');
+    const originalText = statsBtn.innerHTML;
+
+    // Показать загрузку
+    statsBtn.innerHTML = '<div class="loading"></div> Загрузка...';
+    statsBtn.disabled = true;
+
+    try {
+        const response = await fetch(`/stats/${owner}/${repo}?force=true`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+
+        const data = await response.json();
+
+        if (response.ok) {
+            document.getElementById('result').innerHTML = `
+                <div class="card">
+                    <div class="card-header">
+                        <svg class="icon" style="color: var(--success);"><use href="#fa-check-circle"></use></svg>
+                        <h2 class="card-title">Статистика для ${owner}/${repo}</h2>
+                    </div>
+                    <div class="stats-grid">
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-star"></use></svg> Звезды</div>
+                            <div class="stat-value">${data.data.stars}</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-eye"></use></svg> Просмотры</div>
+                            <div class="stat-value">${data.data.views ?? '-'}</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-download"></use></svg> Клоны</div>
+                            <div class="stat-value">${data.data.clones ?? '-'}</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-code-branch"></use></svg> Форки</div>
+                            <div class="stat-value">${data.data.forks}</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-users"></use></svg> Уникальные посетители</div>
+                            <div class="stat-value">${data.data.unique_visitors ?? '-'}</div>
+                        </div>
+                        <div class="stat-card">
+                            <div class="stat-label"><svg class="icon"><use href="#fa-user-check"></use></svg> Уникальные клоны</div>
+                            <div class="stat-value">${data.data.unique_clones ?? '-'}</div>
+                        </div>
+                    </div>
+                    <div style="margin-top: 16px; font-size: 0.875rem; color: var(--text-light);">
+                        <svg class="icon"><use href="#fa-clock"></use></svg> Данные собраны: ${new Date(data.data.collected_at).toLocaleString()}
+                    </div>
+                </div>
+            `;
+            // Виджет отслеживаемого репозитория обновится событием snapshot
+        } else {
+            document.getElementById('result').innerHTML = `
+                <div class="message message-error">
+                    <svg class="icon"><use href="#fa-exclamation-triangle"></use></svg>
+                    <div>${data.detail || 'Произошла ошибка'}</div>
+                </div>
+            `;
+        }
+    } catch (error) {
+        document.getElementById('result').innerHTML = `
+            <div class="message message-error">
+                <svg class="icon"><use href="#fa-exclamation-triangle"></use></svg>
+                <div>Ошибка соединения: ${error.message}</div>
+            </div>
+        `;
+    } finally {
+        // Восстановить кнопку
+        statsBtn.innerHTML = originalText;
+        statsBtn.disabled = false;
+    }
+});
+
+// Авто-сбор: сервер только ставит репозитории в очередь, ход сбора приходит событиями
+async function runAutoCollect() {
+    const autoCollectBtn = document.getElementById('autoCollectBtn');
+    const status = document.getElementById('autoCollectStatus');
+
+    autoCollectBtn.disabled = true;
+
+    try {
+        const response = await fetch('/auto-collect', {
+            method: 'POST',
+            credentials: 'include'
+        });
+        const data = await response.json();
+
+        status.textContent = data.message;
+    } catch (error) {
+        status.textContent = 'Ошибка при авто-сборе: ' + error.message;
+    } finally {
+        autoCollectBtn.disabled = false;
+    }
+}
+
+// Добавить обработчики для форм
+document.getElementById('tokenForm').addEventListener('submit', function() {
+    const btn = document.getElementById('tokenBtn');
+    btn.innerHTML = '<div class="loading"></div> Сохранение...';
+});
+
+document.getElementById('trackForm').addEventListener('submit', function() {
+    const btn = document.getElementById('trackBtn');
+    btn.innerHTML = '<div class="loading"></div> Добавление...';
+    // После добавления репозитория обновляем виджеты
+    setTimeout(loadRepoWidgets, 1000);
+});
+
+// Загрузить виджеты при загрузке страницы и подписаться на обновления
+document.addEventListener('DOMContentLoaded', () => {
+    loadRepoWidgets();
+    connectEvents();
+});